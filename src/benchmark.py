@@ -0,0 +1,457 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import parse_qsl
+
+import numpy as np
+import pandas as pd
+from langchain.vectorstores import FAISS
+
+from download_news_grants import DETAIL_URL, fetch_details, output_csv
+from lang_recommender import data_processing, get_documents, get_embedding_function
+from utils.chunking import chunk_opportunities
+from utils.compact_index import index_report, print_index_report
+from utils.details_store import DETAILS_PATH, append_details
+from utils.http_replay import (
+    HTTP_MODE_ENV,
+    REPLAY_URL_ENV,
+    HttpArchive,
+    ReplayServer,
+)
+
+TOPICS = {
+    "health": "clinical patient hospital disease vaccine nursing mental opioid "
+    "treatment prevention epidemiology diabetes cancer maternal",
+    "education": "school student teacher curriculum literacy university stem "
+    "scholarship classroom tutoring college training learners",
+    "technology": "software cybersecurity artificial intelligence broadband "
+    "semiconductor data cloud computing robotics innovation startup",
+    "agriculture": "farm crop livestock rural soil irrigation food producers "
+    "forestry ranch dairy harvest extension",
+    "energy": "solar wind grid battery efficiency renewable hydrogen nuclear "
+    "emissions carbon utility weatherization",
+    "justice": "victims violence legal court law enforcement prison reentry "
+    "assistance advocacy trafficking prosecution",
+}
+BOILERPLATE = (
+    "Applicants must be registered in SAM.gov and provide a budget narrative. "
+    "Cost sharing is not required. See the full announcement for details."
+)
+FAKE_RECALL_NOTE = "recall is not reported: fake embeddings are random vectors"
+
+# Modules that must start without the heavy optional dependencies below.
+LIGHT_MODULES = ["utils.embeddings_utils", "utils.embedding_service"]
+HEAVY_MODULES = ["matplotlib", "plotly", "sklearn", "scipy", "openai", "pandas"]
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+# ru_maxrss survives exec on Linux and would report the parent's peak
+with open("/proc/self/status") as status:
+    peak_kb = next(int(line.split()[1]) for line in status if line.startswith("VmHWM"))
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": peak_kb / 1e3,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+APPLICANT_TYPES = [
+    "State governments",
+    "County governments",
+    "Nonprofits having a 501(c)(3) status with the IRS",
+    "Small businesses",
+    "Public and State controlled institutions of higher education",
+]
+
+
+@contextmanager
+def measure(results, name, items=None):
+    """Record wall time, peak RSS growth and throughput for a block.
+
+    Memory is read from the process's peak RSS rather than traced, since
+    tracing every allocation would slow down the block being timed.
+    """
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    entry = {"items": items}
+    try:
+        yield entry
+    finally:
+        seconds = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before
+        entry.update(seconds=seconds, rss_growth_mb=peak / 1e3)
+        if entry["items"]:
+            entry["per_second"] = entry["items"] / seconds if seconds else None
+        results[name] = entry
+
+
+def synthetic_details(n=1000, seed=0):
+    """Yield `(detail_record, topic)` pairs shaped like grants.gov details."""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    for i in range(n):
+        topic = topics[i % len(topics)]
+        words = TOPICS[topic].split()
+        description = " ".join(rng.choices(words, k=rng.randint(40, 160)))
+        yield {
+            "id": 900000 + i,
+            "synopsis": {
+                "opportunityId": 900000 + i,
+                "agencyCode": rng.choice(["NSF", "HHS-NIH11", "USDA", "DOE", "DOJ"]),
+                "synopsisDesc": f"{topic.title()} program. {description}",
+                "applicantEligibilityDesc": BOILERPLATE,
+                "applicantTypes": [
+                    {"description": t} for t in rng.sample(APPLICANT_TYPES, 2)
+                ],
+                "fundingInstruments": [{"description": "Grant"}],
+                "postingDateStr": "2024-01-01-00-00-00",
+                "responseDateStr": "2024-12-31-00-00-00",
+            },
+        }, topic
+
+
+def synthetic_queries(n_per_topic=10, seed=1):
+    """Return `(profile_text, topic)` pairs for the synthetic corpus."""
+    rng = random.Random(seed)
+    queries = []
+    for topic, vocabulary in TOPICS.items():
+        words = vocabulary.split()
+        for _ in range(n_per_topic):
+            text = "Our organisation works on " + " ".join(rng.choices(words, k=25))
+            queries.append((text, topic))
+    return queries
+
+
+def recall_at_k(retrieved, relevant, k):
+    """Mean fraction of each query's top-k that is relevant (capped at k)."""
+    scores = [
+        len(set(ids[:k]) & rel) / min(k, len(rel))
+        for ids, rel in zip(retrieved, relevant)
+        if rel
+    ]
+    return float(np.mean(scores)) if scores else None
+
+
+def run_benchmark(
+    corpus="synthetic",
+    n=1000,
+    provider="fake",
+    k=10,
+    labels_path=None,
+    index_types=None,
+    plot_path=None,
+    work_dir=None,
+):
+    """Run ingest, embedding, index and query benchmarks offline.
+
+    `corpus="synthetic"` generates `n` labelled grants across a few topics;
+    `corpus="snapshot"` uses the checked-in details store, with relevance
+    labels (a CSV of `query,opportunity_id`) taken from `labels_path` if given.
+    Returns a dict of measurements. Recall is left out with
+    `provider="fake"`, whose random vectors carry no meaning.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="grants-bench-")
+    results, run_date = {}, "bench"
+    details_path = os.path.join(work_dir, "details.jsonl")
+
+    queries, relevant = [], []
+    if corpus == "synthetic":
+        topic_of = {}
+        with measure(results, "generate", n):
+            records = []
+            for record, topic in synthetic_details(n):
+                records.append(record)
+                topic_of[str(record["id"])] = topic
+            append_details(records, details_path, mode="w")
+        by_topic = defaultdict(set)
+        for opp_id, topic in topic_of.items():
+            by_topic[topic].add(opp_id)
+        labelled = synthetic_queries()
+        queries = [text for text, _ in labelled]
+        query_topics = [topic for _, topic in labelled]
+        relevant = [by_topic[topic] for topic in query_topics]
+    else:
+        with open(DETAILS_PATH, "rb") as src, open(details_path, "wb") as dst:
+            dst.write(src.read())
+        if labels_path:
+            labels = pd.read_csv(labels_path, dtype=str)
+            grouped = labels.groupby("query")["opportunity_id"].apply(set)
+            queries, relevant = list(grouped.index), list(grouped.values)
+
+    with measure(results, "output_csv") as entry:
+        synopsis = output_csv(work_dir, run_date, details_path=details_path)
+        entry["items"] = len(pd.read_csv(synopsis, usecols=["opportunity_id"]))
+    with measure(results, "data_processing", entry["items"]):
+        combined = data_processing(work_dir, run_date)
+    with measure(results, "get_documents") as entry:
+        docs = get_documents(combined)
+        entry["items"] = len(docs)
+
+    # a private cache, so runs neither reuse nor pollute production embeddings
+    embedding_function = get_embedding_function(provider=provider, cache={})
+    texts = [doc.page_content for doc in docs]
+    with measure(results, "embed", len(texts)):
+        vectors = embedding_function.embed_documents(texts)
+    with measure(results, "index_build", len(texts)):
+        db = FAISS.from_embeddings(
+            list(zip(texts, vectors)),
+            embedding_function,
+            metadatas=[doc.metadata for doc in docs],
+        )
+
+    latencies, retrieved = [], []
+    for text in queries or texts[:50]:
+        start = time.perf_counter()
+        hits = db.similarity_search_with_score(text, k=k * 4)
+        latencies.append(time.perf_counter() - start)
+        opp_ids = (opp_id for doc, _ in hits for opp_id in chunk_opportunities(doc))
+        retrieved.append(list(dict.fromkeys(opp_ids)))
+    results["query"] = {
+        "count": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+    if relevant and provider != "fake":
+        results["quality"] = {
+            "recall_at_k": recall_at_k(retrieved, relevant, k),
+            "k": k,
+        }
+
+    if corpus == "synthetic" and plot_path:
+        class_list = list(TOPICS)
+        query_vectors = np.asarray(embedding_function.embed_documents(queries))
+        grant_vectors = np.asarray(vectors)
+        similarity = query_vectors @ grant_vectors.T
+        doc_topics = np.array([topic_of[str(doc.metadata["source"])] for doc in docs])
+        y_score = np.stack(
+            [similarity[:, doc_topics == topic].max(axis=1) for topic in class_list],
+            axis=1,
+        )
+        from utils.embedding_plots import plot_multiclass_precision_recall
+
+        plot_multiclass_precision_recall(
+            y_score, pd.Series(query_topics), class_list, f"{provider} embeddings"
+        )
+        import matplotlib.pyplot as plt
+
+        plt.savefig(plot_path)
+
+    if index_types:
+        grant_vectors = np.asarray(vectors, dtype=np.float32)
+        report = index_report(
+            grant_vectors, grant_vectors[:200], min(k, len(grant_vectors)), index_types
+        )
+        if provider == "fake":
+            for row in report:
+                row["recall_at_k"] = None
+        results["index_types"] = report
+    if provider == "fake":
+        results["note"] = FAKE_RECALL_NOTE
+
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    return results
+
+
+def import_times(modules=None, repeat=3):
+    """Time a cold import of each module in a fresh interpreter.
+
+    Reports the best of `repeat` runs, the resulting peak RSS, and which of
+    `HEAVY_MODULES` the import dragged in.
+    """
+    env = dict(os.environ)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src_dir, env.get("PYTHONPATH")]))
+    results = {}
+    for module in modules or LIGHT_MODULES:
+        code = IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        runs = [
+            json.loads(
+                subprocess.run(
+                    [sys.executable, "-c", code],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout.splitlines()[-1]
+            )
+            for _ in range(repeat)
+        ]
+        results[module] = min(runs, key=lambda run: run["seconds"])
+    return results
+
+
+@contextmanager
+def environment(**values):
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def crawl_benchmark(
+    archive_path,
+    workers=(1, 4, 8, 16),
+    latency=0.05,
+    jitter=0.0,
+    error_rate=0.0,
+    drop_rate=0.0,
+    rate=0.0,
+):
+    """Load-test detail fetching offline against a replay server.
+
+    Every detail request recorded in `archive_path` is replayed once per
+    worker count, with the given injected latency and failures; `rate=0`
+    disables client-side throttling.
+    """
+    ids = [
+        dict(parse_qsl(body.decode("utf-8")))["oppId"]
+        for _, _, body in HttpArchive(archive_path).requests(DETAIL_URL)
+    ]
+    results = {}
+    server = ReplayServer(
+        archive_path,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        drop_rate=drop_rate,
+        seed=0,
+    )
+    with server, environment(**{HTTP_MODE_ENV: "replay", REPLAY_URL_ENV: server.url}):
+        for count in workers:
+            before = dict(server.stats)
+            start = time.perf_counter()
+            fetched = sum(1 for _ in fetch_details(ids, max_workers=count, rate=rate))
+            seconds = time.perf_counter() - start
+            results[count] = {
+                "items": fetched,
+                "seconds": seconds,
+                "per_second": fetched / seconds if seconds else None,
+                **{name: server.stats[name] - before[name] for name in before},
+            }
+    return results
+
+
+def print_crawl_report(results):
+    print(f"{'workers':>8}{'fetched':>9}{'seconds':>10}{'items/s':>10}{'requests':>10}")
+    for count, entry in results.items():
+        print(
+            f"{count:>8}{entry['items']:>9}{entry['seconds']:>10.2f}"
+            f"{entry['per_second'] or 0:>10.1f}{entry['requests']:>10}"
+        )
+
+
+def print_import_report(results):
+    print(f"{'module':<28}{'import ms':>10}{'RSS MB':>9}  heavy modules loaded")
+    for module, entry in results.items():
+        print(
+            f"{module:<28}{entry['seconds'] * 1000:>10.1f}{entry['rss_mb']:>9.1f}"
+            f"  {', '.join(entry['loaded']) or '-'}"
+        )
+
+
+def print_report(results):
+    print(f"{'stage':<18}{'items':>8}{'seconds':>10}{'items/s':>12}{'RSS +MB':>10}")
+    for name, entry in results.items():
+        if isinstance(entry, dict) and "seconds" in entry:
+            per_second = entry.get("per_second")
+            print(
+                f"{name:<18}{entry['items'] or '':>8}{entry['seconds']:>10.3f}"
+                f"{per_second or 0:>12.1f}{entry['rss_growth_mb']:>10.1f}"
+            )
+    query = results["query"]
+    print(
+        f"query latency over {query['count']} queries: "
+        f"p50 {query['p50_ms']:.2f} ms, p99 {query['p99_ms']:.2f} ms"
+    )
+    if "quality" in results:
+        quality = results["quality"]
+        print(f"recall@{quality['k']}: {quality['recall_at_k']:.3f}")
+    if "index_types" in results:
+        print_index_report(results["index_types"], "index types")
+    if "note" in results:
+        print(f"note: {results['note']}")
+    print(f"peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks")
+    parser.add_argument(
+        "--corpus", choices=["synthetic", "snapshot"], default="synthetic"
+    )
+    parser.add_argument("-n", type=int, default=1000, help="synthetic corpus size")
+    parser.add_argument(
+        "--provider",
+        default="fake",
+        help="huggingface, local or fake (fast, but no recall is reported)",
+    )
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--labels", help="CSV of query,opportunity_id labels")
+    parser.add_argument("--index-types", nargs="*", help="index types to compare")
+    parser.add_argument("--plot", help="save the precision-recall plot to this file")
+    parser.add_argument("--json", help="write raw measurements to this file")
+    parser.add_argument(
+        "--imports",
+        nargs="*",
+        help="only time cold imports of these modules (default: the light ones) "
+        "and fail if a light module loads a heavy dependency",
+    )
+    parser.add_argument("--crawl", help="load-test the crawler on this HTTP archive")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.crawl:
+        results = crawl_benchmark(
+            args.crawl,
+            args.workers,
+            args.latency_ms / 1000,
+            error_rate=args.error_rate,
+        )
+        print_crawl_report(results)
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=4)
+        sys.exit(0)
+
+    if args.imports is not None:
+        results = import_times(args.imports)
+        print_import_report(results)
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=4)
+        regressions = [
+            module
+            for module, entry in results.items()
+            if module in LIGHT_MODULES and entry["loaded"]
+        ]
+        sys.exit(1 if regressions else 0)
+
+    results = run_benchmark(
+        args.corpus,
+        args.n,
+        args.provider,
+        args.k,
+        args.labels,
+        args.index_types,
+        args.plot,
+    )
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
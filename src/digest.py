@@ -0,0 +1,92 @@
+import argparse
+import json
+from datetime import date
+
+from matcher import batch_match
+from utils.snapshots import (
+    CHECKPOINT_DAYS,
+    SNAPSHOT_DIR,
+    compact_snapshots,
+    diff_snapshots,
+    snapshot_dates,
+)
+
+
+def previous_date(day, data_dir=SNAPSHOT_DIR):
+    """Return the latest snapshot date before `day`, or None."""
+    earlier = [other for other in snapshot_dates(data_dir) if other < day]
+    return earlier[-1] if earlier else None
+
+
+def new_grants_digest(
+    profiles_path, output_path, day=None, since=None, data_dir=SNAPSHOT_DIR, **kwargs
+):
+    """Match profiles against only the grants added or changed since `since`.
+
+    `since` defaults to the snapshot before `day`. Other keyword arguments go
+    to `batch_match`. Returns the snapshot diff.
+    """
+    day = day or date.today().strftime("%Y-%m-%d")
+    since = since or previous_date(day, data_dir)
+    if since is None:
+        raise ValueError(f"No snapshot before {day} to diff against")
+
+    diff = diff_snapshots(since, day, data_dir)
+    print(diff.summary())
+    if not diff.changed:
+        print("No new or changed grants; nothing to match")
+        return diff
+    batch_match(profiles_path, output_path, opportunity_ids=diff.changed, **kwargs)
+    return diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot diffs and new-grant digests")
+    parser.add_argument("--data-dir", default=SNAPSHOT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    diff_parser = commands.add_parser("diff", help="compare two snapshot dates")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--json", action="store_true", help="print the ids too")
+
+    compact_parser = commands.add_parser(
+        "compact", help="store older snapshots as reverse deltas"
+    )
+    compact_parser.add_argument("--keep", type=int, default=1)
+    compact_parser.add_argument(
+        "--checkpoint",
+        type=int,
+        default=CHECKPOINT_DAYS,
+        help="keep every Nth day as a full snapshot (0: none)",
+    )
+
+    match_parser = commands.add_parser(
+        "match", help="match profiles against new and changed grants only"
+    )
+    match_parser.add_argument("profiles")
+    match_parser.add_argument("output")
+    match_parser.add_argument("--date", help="snapshot date (default: today)")
+    match_parser.add_argument("--since", help="baseline date (default: previous)")
+    match_parser.add_argument("-k", type=int, default=10)
+    match_parser.add_argument("--provider", default="huggingface")
+    match_parser.add_argument("--hybrid", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        diff = diff_snapshots(args.old, args.new, args.data_dir)
+        print(json.dumps(diff.__dict__, indent=4) if args.json else diff.summary())
+    elif args.command == "compact":
+        compacted = compact_snapshots(args.data_dir, args.keep, args.checkpoint)
+        print(f"Compacted {len(compacted)} snapshots: {', '.join(compacted) or '-'}")
+    else:
+        new_grants_digest(
+            args.profiles,
+            args.output,
+            args.date,
+            args.since,
+            args.data_dir,
+            k=args.k,
+            provider=args.provider,
+            hybrid=args.hybrid,
+        )
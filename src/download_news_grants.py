@@ -1,97 +1,346 @@
 import asyncio
 import json
 import csv
+import gzip
 import os
+import threading
+import time
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
 from datetime import date
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from bs4 import BeautifulSoup, SoupStrainer
 
+from utils.details_store import DETAILS_PATH, append_details, iter_details
+from utils.http_replay import ReplayMiss, http_mode, transport_adapter
+from utils.manifest import Manifest
+from utils.metrics import incr, timed
 
-async def eligibility_extractor():
-    url = "https://grants.gov/search-grants"
+
+ELIGIBILITY_URL = "https://grants.gov/search-grants"
+ELIGIBILITY_CACHE_PATH = "src/data/eligibilities.json"
+ELIGIBILITY_TTL = 7 * 24 * 60 * 60
+
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+def parse_eligibilities(html_content):
+    """Return the eligibility checkbox labels from the search page HTML.
+
+    Only the eligibility filter panel (`#m-a2`) is parsed.
+    """
+    soup = BeautifulSoup(
+        html_content, HTML_PARSER, parse_only=SoupStrainer(id="m-a2")
+    )
+    labels = soup.select("label.usa-checkbox__label.margin-top-1")
+    eligibilities = [label.text for label in labels]
+    return [eleg.split("(")[0].strip() for eleg in eligibilities]
+
+
+async def render_page(url, selector):
+    """Render `url` in headless Chromium; return its HTML once `selector` exists."""
+    from playwright.async_api import async_playwright
 
     async with async_playwright() as p:
         browser = await p.chromium.launch()
         page = await browser.new_page()
-        await page.goto(url, wait_until="load")
-        await asyncio.sleep(2)
+        await page.goto(url, wait_until="domcontentloaded")
+        await page.wait_for_selector(selector, state="attached", timeout=15000)
         html_content = await page.content()
         await browser.close()
+    return html_content
 
-    soup = BeautifulSoup(html_content, "html.parser")
-    labels = soup.select("#m-a2 label.usa-checkbox__label.margin-top-1")
-    eligibilities = [label.text for label in labels]
-    return [eleg.split("(")[0].strip() for eleg in eligibilities]
 
+def _read_eligibility_cache(cache_path):
+    try:
+        with open(cache_path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-def grant_list():
-    headers = {
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Connection": "keep-alive",
-        "Content-Type": "application/json",
-        "Origin": "https://grants.gov",
-        "Referer": "https://grants.gov/",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-site",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "sec-ch-ua": '"Google Chrome";v="119", "Chromium";v="119", "Not?A_Brand";v="24"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-    }
 
+async def eligibility_extractor(
+    cache_path=ELIGIBILITY_CACHE_PATH, ttl=ELIGIBILITY_TTL, refresh=False
+):
+    """Return the grants.gov eligibility taxonomy, cached on disk for `ttl` seconds.
+
+    A stale or missing cache is refreshed from the static page HTML first;
+    the headless browser is only launched if the labels are not present
+    there. If refreshing fails, a stale cache is returned rather than nothing.
+    """
+    cached = _read_eligibility_cache(cache_path)
+    if cached and not refresh and time.time() - cached["fetched_at"] < ttl:
+        return cached["eligibilities"]
+
+    eligibilities = []
+    try:
+        response = await asyncio.to_thread(
+            get_session(pool_size=1).get, ELIGIBILITY_URL, timeout=30
+        )
+        response.raise_for_status()
+        eligibilities = parse_eligibilities(response.text)
+    except requests.RequestException as e:
+        print(f"Static fetch of eligibilities failed: {e}")
+
+    # a replayed run must not reach the live site through the browser
+    if not eligibilities and http_mode() != "replay":
+        try:
+            html_content = await render_page(ELIGIBILITY_URL, "#m-a2 label")
+            eligibilities = parse_eligibilities(html_content)
+        except Exception as e:
+            print(f"Rendering eligibilities failed: {e}")
+
+    if not eligibilities:
+        if cached:
+            return cached["eligibilities"]
+        raise RuntimeError("Could not extract the eligibility taxonomy")
+
+    with open(cache_path, "w") as file:
+        json.dump({"fetched_at": time.time(), "eligibilities": eligibilities}, file)
+    return eligibilities
+
+
+SEARCH_URL = "https://apply07.grants.gov/grantsws/rest/opportunities/search"
+DETAIL_URL = "https://apply07.grants.gov/grantsws/rest/opportunity/details"
+
+HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+    "Origin": "https://grants.gov",
+    "Referer": "https://grants.gov/",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-site",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "sec-ch-ua": '"Google Chrome";v="119", "Chromium";v="119", "Not?A_Brand";v="24"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+}
+
+
+class RateLimiter:
+    """Thread-safe per-host limiter allowing at most `rate` requests per second."""
+
+    def __init__(self, rate=10.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def get_session(pool_size=16):
+    """Return a session whose connection pool can serve `pool_size` workers.
+
+    The transport follows `$GRANTS_HTTP_MODE`: live, recording responses to
+    an archive, or replaying them offline (see `utils.http_replay`).
+    """
+    session = requests.Session()
+    adapter = transport_adapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def _retryable(error: BaseException) -> bool:
+    """Retry dropped connections, timeouts, throttling and server errors."""
+    if isinstance(error, ReplayMiss):
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+@retry(
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception(_retryable),
+)
+def _post(session, url, rate_limiter=None, **kwargs):
+    if rate_limiter is not None:
+        rate_limiter.wait(url)
+    incr("http.requests")
+    try:
+        with timed("http." + url.rstrip("/").rsplit("/", 1)[-1]):
+            response = session.post(url, timeout=30, **kwargs)
+    except requests.RequestException:
+        # connection errors and timeouts never produce a response
+        incr("http.errors")
+        raise
+    incr("http.bytes_received", len(response.content))
+    if not response.ok:
+        incr("http.errors")
+    response.raise_for_status()
+    return response.json()
+
+
+def search_payload(start=0, rows=5000, date_range="3", **filters):
+    """Return the search request body; `date_range=None` searches all dates."""
     json_data = {
         "keyword": None,
         "oppNum": None,
         "cfda": None,
         "agencies": None,
         "sortBy": "openDate|desc",
-        "rows": 5000,
+        "rows": rows,
+        "startRecordNum": start,
         "eligibilities": None,
         "fundingCategories": None,
         "fundingInstruments": None,
-        "dateRange": "3",
+        "dateRange": date_range or "",
         "oppStatuses": "forecasted|posted",
     }
+    json_data.update(filters)
+    return json_data
 
-    response = requests.post(
-        "https://apply07.grants.gov/grantsws/rest/opportunities/search",
-        headers=headers,
-        json=json_data,
+
+def search_page(start, rows, session, rate_limiter=None, **kwargs):
+    return _post(
+        session,
+        SEARCH_URL,
+        rate_limiter=rate_limiter,
+        headers={"Content-Type": "application/json"},
+        json=search_payload(start=start, rows=rows, **kwargs),
     )
-    return response.json()["oppHits"]
-
-
-def grant_detail(id="350938"):
-    headers = {
-        "Accept": "*/*",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Connection": "keep-alive",
-        "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
-        "Origin": "https://grants.gov",
-        "Referer": "https://grants.gov/",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-site",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "sec-ch-ua": '"Google Chrome";v="119", "Chromium";v="119", "Not?A_Brand";v="24"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-    }
 
+
+def iter_grant_list(page_size=500, prefetch=4, rate=10.0, session=None, **kwargs):
+    """Yield search hits page by page, in listing order.
+
+    The first page reports the total hit count; the remaining pages are then
+    fetched with up to `prefetch` requests in flight. Extra keyword arguments
+    are passed to `search_payload`, e.g. `date_range=None` to backfill the full
+    history or `oppStatuses="closed|archived"`.
+    """
+    session = session or get_session(pool_size=prefetch)
+    rate_limiter = RateLimiter(rate)
+
+    first = search_page(0, page_size, session, rate_limiter, **kwargs)
+    yield from first.get("oppHits", [])
+
+    starts = range(page_size, first.get("hitCount", 0), page_size)
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = deque()
+        for start in starts:
+            pending.append(
+                executor.submit(
+                    search_page, start, page_size, session, rate_limiter, **kwargs
+                )
+            )
+            if len(pending) >= prefetch:
+                yield from pending.popleft().result().get("oppHits", [])
+        while pending:
+            yield from pending.popleft().result().get("oppHits", [])
+
+
+def grant_list(session=None, **kwargs):
+    return list(iter_grant_list(session=session, **kwargs))
+
+
+def grant_detail(id="350938", session=None, rate_limiter=None):
     data = {
         "oppId": id,
     }
 
-    response = requests.post(
-        "https://apply07.grants.gov/grantsws/rest/opportunity/details",
-        headers=headers,
+    session = session or get_session(pool_size=1)
+    return _post(
+        session,
+        DETAIL_URL,
+        rate_limiter=rate_limiter,
+        headers={
+            "Accept": "*/*",
+            "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
+        },
         data=data,
     )
-    return response.json()
+
+
+def fetch_details(ids, max_workers=8, rate=10.0, session=None):
+    """Yield `(id, detail)` pairs as they complete, fetched concurrently.
+
+    Requests share one pooled session and are throttled to `rate` requests per
+    second per host. Ids that still fail after retries are reported and skipped.
+    """
+    session = session or get_session(pool_size=max_workers)
+    rate_limiter = RateLimiter(rate)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(grant_detail, id, session, rate_limiter): id for id in ids
+        }
+        for future in as_completed(futures):
+            id = futures[future]
+            try:
+                yield id, future.result()
+            except Exception as e:
+                print(f"Error fetching details for {id}: {e}")
+
+
+def write_details(ids, outfile=DETAILS_PATH, mode="a", **kwargs):
+    """Fetch details for `ids` concurrently and stream them into `outfile`.
+
+    Records are appended as JSON lines as soon as they arrive, so memory stays
+    flat regardless of how many opportunities are fetched.
+    """
+    return append_details(
+        (detail for _, detail in fetch_details(ids, **kwargs)), outfile, mode=mode
+    )
+
+
+def incremental_crawl(
+    hits,
+    outfile=DETAILS_PATH,
+    manifest_path="src/data/manifest.sqlite",
+    commit_every=100,
+    **kwargs,
+):
+    """Fetch details only for new or changed hits and carry the rest forward.
+
+    `hits` is the output of `grant_list`. Opportunities that dropped out of the
+    listing are pruned from the manifest, and the full current set of details
+    is written to `outfile`.
+    """
+    with Manifest(manifest_path) as manifest:
+        stale = {str(hit["id"]): hit for hit in manifest.stale(hits)}
+        print(f"{len(stale)} of {len(hits)} opportunities are new or changed")
+
+        for count, (id, detail) in enumerate(
+            fetch_details(list(stale), **kwargs), start=1
+        ):
+            manifest.update(stale[str(id)], detail)
+            if count % commit_every == 0:
+                manifest.commit()
+        manifest.commit()
+
+        manifest.prune(hit["id"] for hit in hits)
+        return append_details(manifest.details(), outfile, mode="w")
 
 
 # Extracting fields
@@ -107,63 +356,102 @@ def slugify(text: str):
     return text.lower().replace(" ", "_")
 
 
-def output_csv(data_dir="src/data/synopsis", today=None):
+def _section_value(grant, key, sections=("synopsis", "forecast")):
+    """Return the first non-empty `key` found in the given detail sections."""
+    for section in sections:
+        value = (grant.get(section) or {}).get(key)
+        if value:
+            return value
+    return ""
+
+
+def _applicant_types(grant):
+    return ",".join(
+        type.get("description", "")
+        for section in ("synopsis", "forecast")
+        for type in (grant.get(section) or {}).get("applicantTypes", [])
+    )
+
+
+field_extractors = {
+    "opportunity_id": lambda grant: _section_value(grant, "opportunityId"),
+    "description": lambda grant: _section_value(grant, "synopsisDesc"),
+    "applicant_eligibilty_desc": lambda grant: _section_value(
+        grant, "applicantEligibilityDesc", ("forecast", "synopsis")
+    ),
+    "applicant_types": _applicant_types,
+}
+
+
+def _extractor(field):
+    """Return the extractor for `field`.
+
+    Names without an entry in `field_extractors` are looked up as raw detail
+    keys, first in the synopsis and forecast sections and then at the top
+    level of the record (e.g. `opportunityTitle`).
+    """
+    return field_extractors.get(field) or (
+        lambda grant: _section_value(grant, field) or grant.get(field) or ""
+    )
+
+
+def iter_rows(fields=synopsis_fields, details_path=DETAILS_PATH):
+    extractors = {field: _extractor(field) for field in fields}
+    projection = ["synopsis", "forecast"]
+    projection += [field for field in fields if field not in field_extractors]
+    for grant in iter_details(details_path, fields=projection):
+        row = {}
+        for field, extract in extractors.items():
+            try:
+                row[field] = extract(grant)
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                row[field] = ""
+        yield row
+
+
+def output_csv(
+    data_dir="src/data/synopsis",
+    today=None,
+    fields=synopsis_fields,
+    details_path=DETAILS_PATH,
+    batch_size=500,
+    compress=False,
+):
+    """Flatten every detail record into `{data_dir}/{today}.csv` in one pass.
+
+    Records are streamed from the details store and written in batches of
+    `batch_size` rows. With `compress=True` the output is gzipped. Returns the
+    path written.
+    """
     if today is None:
         today = date.today().strftime("%Y-%m-%d")
 
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
-    synopsis_fields = [
-        "opportunity_id",
-        "description",
-        "applicant_eligibilty_desc",
-        "applicant_types",
-    ]
-
-    # Write data to CSV
-    with open("src/data/details.json", "r") as file:
-        full_data = json.load(file)
-
-    for grant in full_data:
-        with open(
-            f"{data_dir}/{today}.csv", mode="w", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.DictWriter(file, fieldnames=synopsis_fields)
-            writer.writeheader()
-
-            # Write data to CSV file
-            applicant_types = ""
-            try:
-                applicant_types = ",".join(
-                    [
-                        type.get("description", "")
-                        for type in grant.get("synopsis", {}).get("applicantTypes", [])
-                    ]
-                    + [
-                        type.get("description", "")
-                        for type in grant.get("forecast", {}).get("applicantTypes", [])
-                    ]
-                )
-            except Exception as e:
-                print(f"Error occurred: {e}")
-                pass
-
-            writer.writerow(
-                {
-                    "opportunity_id": grant.get("synopsis", {}).get("opportunityId", "")
-                    or grant.get("forecast", {}).get("opportunityId", ""),
-                    "description": grant.get("synopsis", {}).get("synopsisDesc", "")
-                    or grant.get("forecast", {}).get("synopsisDesc", ""),
-                    "applicant_eligibilty_desc": grant.get("forecast", {}).get(
-                        "applicantEligibilityDesc", ""
-                    )
-                    or grant.get("synopsis", {}).get("applicantEligibilityDesc", ""),
-                    "applicant_types": applicant_types,
-                }
-            )
+    outfile = f"{data_dir}/{today}.csv" + (".gz" if compress else "")
+    opener = gzip.open if compress else open
+
+    count = 0
+    with opener(outfile, mode="wt", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+
+        batch = []
+        for row in iter_rows(fields, details_path):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.writerows(batch)
+                count += len(batch)
+                batch = []
+        writer.writerows(batch)
+        count += len(batch)
 
-    print(f"Data has been written to {today}.csv")
+    incr("output_csv.rows", count)
+    incr("output_csv.bytes_written", os.path.getsize(outfile))
+    print(f"{count} grants have been written to {outfile}")
+    return outfile
 
 
 if __name__ == "__main__":
@@ -174,8 +462,7 @@ if __name__ == "__main__":
     # with open("src/data/grants.json", "r") as file:
     #     data = json.load(file)
 
-    # with open("src/data/details.json", "a") as file:
-    #     for grant in data:
-    #         file.write(json.dumps(grant_detail(grant["id"]), indent=4))
+    # write_details([grant["id"] for grant in data])
+    # incremental_crawl(data)
 
     output_csv()
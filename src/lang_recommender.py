@@ -1,7 +1,5 @@
 import os
-import csv
 import openai
-import tiktoken
 import pandas as pd
 
 from datetime import date
@@ -10,66 +8,149 @@ from langchain.vectorstores import Chroma
 from langchain.vectorstores import FAISS
 from langchain.embeddings import FakeEmbeddings
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.document_loaders.csv_loader import CSVLoader
 from langchain.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+from langchain.schema.embeddings import Embeddings
 
+from utils.chunking import chunk_documents, iter_rows
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_service import EmbeddingService, threaded_backend
+from utils.eligibility_index import build_eligibility_index
+from utils.local_embeddings import LocalEmbeddings
+from utils.metrics import incr
+from utils.vector_index import update_index
 
-today = date.today().strftime("%Y-%m-%d")
 
 
-def data_processing(data_dir="src/data/synopsis"):
-    data = pd.read_csv(f"{data_dir}/{today}.csv")
-    data["description"] = data.apply(
-        lambda row: f"Synopsis Description: {row.get('description', '').strip()}. Applicant Eligibility Description: {row.get('applicant_eligibilty_desc', '').strip()}. Applicant Types: {row.get('applicant_types', '').strip()}",
-        axis=1,
+def combine_descriptions(data):
+    """Return `data` reduced to opportunity id plus one combined description."""
+    text = data.reindex(
+        columns=["description", "applicant_eligibilty_desc", "applicant_types"]
+    )
+    text = text.fillna("").astype(str).apply(lambda column: column.str.strip())
+    description = (
+        "Synopsis Description: "
+        + text["description"]
+        + ". Applicant Eligibility Description: "
+        + text["applicant_eligibilty_desc"]
+        + ". Applicant Types: "
+        + text["applicant_types"]
+    )
+    return pd.DataFrame(
+        {
+            "opportunity_id": data["opportunity_id"],
+            "description": description.str.strip(),
+        }
     )
 
-    # Define the headers for the output CSV file
-    headers = ["opportunity_id", "description"]
 
+def data_processing(data_dir="src/data/synopsis", today=None, chunksize=None):
+    """Write `{today}-combined.csv` with one combined description per grant.
+
+    With `chunksize`, the input is read and written that many rows at a time
+    so memory stays bounded for large crawls.
+    """
+    if today is None:
+        today = date.today().strftime("%Y-%m-%d")
+
+    infile = f"{data_dir}/{today}.csv"
     outfile = f"{data_dir}/{today}-combined.csv"
-    with open(outfile, "w", newline="") as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=headers)
 
-        writer.writeheader()
+    if chunksize is None:
+        combine_descriptions(pd.read_csv(infile)).to_csv(outfile, index=False)
+        incr("data_processing.bytes_written", os.path.getsize(outfile))
+        return outfile
 
-        for _, row in data.iterrows():
-            row = row.to_dict()
-            # Extract the desired fields from each row
-            output_row = {
-                "opportunity_id": row["opportunity_id"],
-                "description": row["description"].strip(),
-            }
+    for i, chunk in enumerate(pd.read_csv(infile, chunksize=chunksize)):
+        combine_descriptions(chunk).to_csv(
+            outfile, mode="w" if i == 0 else "a", header=i == 0, index=False
+        )
+    incr("data_processing.bytes_written", os.path.getsize(outfile))
+    return outfile
 
-            # Write the extracted fields to the output file
-            writer.writerow(output_row)
-    return f"{data_dir}/{today}-combined.csv"
 
+def get_documents(csv_path, max_tokens=256, dedup=True):
+    """Chunk the combined CSV into token-bounded, de-duplicated documents.
 
-def get_documents(csv_path):
-    loader = CSVLoader(file_path=csv_path)
-    data = loader.load()
+    Chunks shared by several grants are kept once; see `chunk_documents`.
+    """
+    return chunk_documents(iter_rows(csv_path), max_tokens, dedup)
 
-    # data transformers
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    return text_splitter.split_documents(data)
 
+class ServiceEmbeddings(Embeddings):
+    """Langchain embeddings that route through a shared `EmbeddingService`."""
 
-def text_embedding(
-    docs, openapi_key=None, data_dir="src/data/", provider="huggingface"
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def embed_documents(self, texts):
+        return self.service.embed(texts)
+
+    def embed_query(self, text):
+        return self.service.embed([text])[0]
+
+    async def aembed_documents(self, texts):
+        return await self.service.aembed(texts)
+
+    async def aembed_query(self, text):
+        return (await self.service.aembed([text]))[0]
+
+
+def get_embedding_function(
+    openapi_key=None, provider="huggingface", cache=None, **local_options
 ):
+    concurrency = 4
     if provider == "huggingface":
-        embedding_function = SentenceTransformerEmbeddings(
-            model_name="all-MiniLM-L6-v2"
-        )
+        model = "all-MiniLM-L6-v2"
+        embed = SentenceTransformerEmbeddings(model_name=model).embed_documents
+    elif provider == "local":
+        local = LocalEmbeddings(**local_options)
+        model, embed = local.cache_key, local.encode
+        # one large batch at a time; LocalEmbeddings spreads it over all cores
+        concurrency = 1
     elif provider == "openai":
         if openapi_key is None:
-            raise
-        embedding_function = OpenAIEmbeddings(openai_openapi_key=openapi_key)
+            raise ValueError("An OpenAI API key is required for the openai provider")
+        model = "text-embedding-ada-002"
+        embed = OpenAIEmbeddings(
+            model=model, openai_api_key=openapi_key
+        ).embed_documents
     else:
-        embedding_function = FakeEmbeddings(size=1352)
+        return FakeEmbeddings(size=1352)
+
+    if cache is None:
+        cache = EmbeddingCache()
+    service = EmbeddingService(
+        threaded_backend(embed), model, cache=cache, concurrency=concurrency
+    )
+    return ServiceEmbeddings(service)
+
+
+def text_embedding(
+    docs,
+    openapi_key=None,
+    data_dir="src/data/",
+    provider="huggingface",
+    incremental=True,
+    today=None,
+    index_type=None,
+):
+    """Return a FAISS store over `docs`.
+
+    By default the persistent index in `{data_dir}/grants_db` is updated in
+    place, embedding only new or changed grants, and a compact copy of
+    `index_type` is exported with it if given (see `update_index`). With
+    `incremental=False` a standalone index is built for the day in
+    `{data_dir}/{today}_db`.
+    """
+    embedding_function = get_embedding_function(openapi_key, provider)
+
+    if incremental:
+        return update_index(
+            docs, embedding_function, os.path.join(data_dir, "grants_db"), index_type
+        )
 
+    if today is None:
+        today = date.today().strftime("%Y-%m-%d")
     today_db_file = os.path.join(data_dir, f"{today}_db")
 
     if os.path.exists(today_db_file):
@@ -120,6 +201,7 @@ No previous grants or external funding received; self-funded since inception in
     outputfile = data_processing()
     docs = get_documents(outputfile)
     db = text_embedding(docs)
+    build_eligibility_index()
     similarity_docs = get_similarity_docs(db, business_description)
     import pprint
 
@@ -0,0 +1,274 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from lang_recommender import get_embedding_function
+from matcher import embedding_model_name, ranked_opportunities, search_vectors
+from utils.metrics import incr
+from utils.result_cache import ResultCache, params_key
+from utils.vector_index import INDEX_DIR, current_version, load_index
+
+
+class IndexHolder:
+    """Keeps the live index build in memory and hot-swaps it when it changes.
+
+    A background thread polls the index directory's CURRENT pointer; a new
+    build is loaded off to the side and swapped in with a single assignment
+    of `current`, a `(db, version)` pair. Queries run against the build they
+    `acquire`, and a replaced build's memory-mapped docstore is closed once
+    the last of them has finished.
+    """
+
+    def __init__(self, embedding_function, index_dir=INDEX_DIR, poll_interval=30.0):
+        self.embedding_function = embedding_function
+        self.index_dir = index_dir
+        self.poll_interval = poll_interval
+        db, _ = load_index(index_dir, embedding_function)
+        if db is None:
+            raise FileNotFoundError(f"No index build found in {index_dir}")
+        self.current = (db, current_version(index_dir))
+        self._lock = threading.Lock()
+        self._readers = Counter()
+        self._retired = {}
+        self._stop = threading.Event()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    @property
+    def version(self):
+        return self.current[1]
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
+
+    def reload(self):
+        """Swap in the build CURRENT points at, if it is not the live one."""
+        version = current_version(self.index_dir)
+        if version == self.version:
+            return
+        try:
+            db, _ = load_index(self.index_dir, self.embedding_function)
+        except Exception as e:
+            print(f"Failed to load index build {version}: {e}")
+            return
+        with self._lock:
+            old_db, old_version = self.current
+            self.current = (db, version)
+            if self._readers[old_version]:
+                self._retired[old_version] = old_db
+            else:
+                _close(old_db)
+        print(f"Switched to index build {version}")
+
+    @contextmanager
+    def acquire(self):
+        """Hold the live `(db, version)` open for the duration of a query."""
+        with self._lock:
+            db, version = self.current
+            self._readers[version] += 1
+        try:
+            yield db, version
+        finally:
+            with self._lock:
+                self._readers[version] -= 1
+                if not self._readers[version]:
+                    del self._readers[version]
+                    if version in self._retired:
+                        _close(self._retired.pop(version))
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            _close(self.current[0])
+            for db in self._retired.values():
+                _close(db)
+            self._retired.clear()
+
+
+def _close(db):
+    close = getattr(db.docstore, "close", None)
+    if close is not None:
+        close()
+
+
+class MicroBatcher:
+    """Coalesces concurrent queries into one encoder pass and one index search.
+
+    The worker takes the first waiting query, then gathers any others that
+    arrive within `max_wait` seconds (up to `max_batch`), embeds them together
+    and searches the index once for the whole batch.
+    """
+
+    def __init__(
+        self, holder: IndexHolder, max_batch=32, max_wait=0.005, cache=None
+    ):
+        self.holder = holder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache = cache
+        self.model = embedding_model_name(holder.embedding_function)
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, text, k=10) -> Future:
+        """Queue a query; repeats against the live build resolve immediately."""
+        future = Future()
+        if self.cache is not None:
+            version = self.holder.version
+            _, matches = self.cache.lookup(text, self.model, version, params_key(k=k))
+            if matches is not None:
+                incr("match.cache_hits")
+                future.set_result((version, matches))
+                return future
+            incr("match.cache_misses")
+        self.queue.put((text, k, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                texts = [text for text, _, _ in batch]
+                vectors = np.asarray(
+                    self.holder.embedding_function.embed_documents(texts),
+                    dtype=np.float32,
+                )
+                k = max(k for _, k, _ in batch)
+                with self.holder.acquire() as (db, version):
+                    distances, positions = search_vectors(
+                        db, vectors, min(k * 4, db.index.ntotal)
+                    )
+                    ranked = ranked_opportunities(db, distances, positions, k)
+                for (text, k, future), vector, matches in zip(batch, vectors, ranked):
+                    if self.cache is not None:
+                        params = params_key(k=k)
+                        self.cache.store(
+                            text, self.model, version, params, vector, matches[:k]
+                        )
+                    future.set_result((version, matches[:k]))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+
+def make_handler(batcher: MicroBatcher, timeout=30.0):
+    class MatchHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            self._send(200, {"status": "ok", "index_version": batcher.holder.version})
+
+        def do_POST(self):
+            if self.path != "/match":
+                return self._send(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                text, k = request["text"], int(request.get("k", 10))
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": f"invalid request: {e}"})
+
+            try:
+                version, matches = batcher.submit(text, k).result(timeout)
+            except Exception as e:
+                return self._send(500, {"error": str(e)})
+            self._send(
+                200,
+                {
+                    "index_version": version,
+                    "matches": [
+                        {"opportunity_id": opp_id, "distance": distance}
+                        for opp_id, distance in matches
+                    ],
+                },
+            )
+
+        def log_message(self, format, *args):
+            pass
+
+    return MatchHandler
+
+
+def serve(
+    host="127.0.0.1",
+    port=8765,
+    provider="huggingface",
+    index_dir=INDEX_DIR,
+    max_batch=32,
+    max_wait=0.005,
+    poll_interval=30.0,
+    cache_size=1024,
+):
+    """Load the model and index once, then answer match queries over HTTP.
+
+    POST /match with `{"text": ..., "k": 10}` returns the ranked opportunities;
+    GET /health reports the index build being served. Repeat queries against
+    the same build are answered from an in-memory cache of `cache_size`
+    entries.
+    """
+    embedding_function = get_embedding_function(provider=provider)
+    holder = IndexHolder(embedding_function, index_dir, poll_interval)
+    cache = ResultCache(path=None, memory_entries=cache_size) if cache_size else None
+    batcher = MicroBatcher(holder, max_batch, max_wait, cache)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f"Serving index build {holder.version} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        holder.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident grant matching service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--provider", default="huggingface")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument(
+        "--cache-size", type=int, default=1024, help="cached queries (0 disables)"
+    )
+    args = parser.parse_args()
+
+    serve(
+        args.host,
+        args.port,
+        args.provider,
+        args.index_dir,
+        args.max_batch,
+        args.max_wait_ms / 1000,
+        args.poll_interval,
+        args.cache_size,
+    )
@@ -0,0 +1,417 @@
+import argparse
+import csv
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from lang_recommender import get_embedding_function
+from utils.bm25_index import BM25_INDEX_DIR, BM25Index
+from utils.chunking import chunk_opportunities
+from utils.eligibility_index import ELIGIBILITY_INDEX_PATH, EligibilityIndex
+from utils.metrics import incr
+from utils.result_cache import RESULT_CACHE_PATH, ResultCache, params_key
+from utils.vector_index import (
+    INDEX_DIR,
+    build_version,
+    embedding_model_name,
+    load_index,
+)
+
+MATCH_FIELDS = ["profile_id", "rank", "opportunity_id", "distance"]
+RRF_K = 60
+# filtered searches on PQ/HNSW indexes score up to this many chunks exactly
+EXACT_SEARCH_MAX = 50_000
+EXACT_SEARCH_BLOCK = 8192
+
+
+def position_map(db):
+    """Map each opportunity id to the index positions of its chunks."""
+    positions = defaultdict(list)
+    for position, doc_id in db.index_to_docstore_id.items():
+        for opp_id in chunk_opportunities(db.docstore.search(doc_id)):
+            positions[opp_id].append(position)
+    return positions
+
+
+def opportunity_positions(db, opp_ids, positions=None):
+    """Return the index positions of every chunk belonging to `opp_ids`."""
+    positions = position_map(db) if positions is None else positions
+    selected = {p for opp_id in opp_ids for p in positions.get(str(opp_id), ())}
+    return np.array(sorted(selected), dtype=np.int64)
+
+
+def _exact_search(index, vectors, k, positions, block=EXACT_SEARCH_BLOCK):
+    """Score `positions` exactly against their stored (decoded) vectors."""
+    best_distances = np.full((len(vectors), 0), np.inf, dtype=np.float32)
+    best_positions = np.empty((len(vectors), 0), dtype=np.int64)
+    norms = (vectors**2).sum(axis=1, keepdims=True)
+    for start in range(0, len(positions), block):
+        ids = positions[start : start + block]
+        stored = index.reconstruct_batch(ids)
+        distances = norms - 2 * vectors @ stored.T + (stored**2).sum(axis=1)
+        distances = np.concatenate([best_distances, distances], axis=1)
+        candidates = np.concatenate(
+            [best_positions, np.broadcast_to(ids, (len(vectors), len(ids)))], axis=1
+        )
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        best_distances = np.take_along_axis(distances, order, axis=1)
+        best_positions = np.take_along_axis(candidates, order, axis=1)
+    return np.maximum(best_distances, 0).astype(np.float32), best_positions
+
+
+def search_positions(db, vectors, k, positions):
+    """Search only the given index positions.
+
+    Flat, scalar-quantized and IVF indexes take the selection as a search
+    parameter. PQ indexes reject it, and an HNSW graph walk misses most of a
+    small selection, so those score the selected vectors exactly instead;
+    only selections too large for that walk HNSW with a raised efSearch.
+    """
+    index = db.index
+    selector = faiss.IDSelectorBatch(positions)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif isinstance(index, faiss.IndexHNSW) and len(positions) > EXACT_SEARCH_MAX:
+        ef_search = int(np.ceil(4 * k * index.ntotal / len(positions)))
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=max(index.hnsw.efSearch, ef_search)
+        )
+    elif isinstance(index, (faiss.IndexHNSW, faiss.IndexPQ)):
+        return _exact_search(index, np.asarray(vectors), k, positions)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(vectors, k, params=params)
+
+
+def search_vectors(db, vectors, k=10, allowed_ids=None, positions=None):
+    """Search the FAISS index for a batch of query vectors in one call.
+
+    With `allowed_ids`, only chunks of those opportunities are scored;
+    `positions` is a precomputed `position_map(db)` to select them with.
+    Returns `(distances, positions)` arrays of shape (n_queries, k); missing
+    results are marked with position -1.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if allowed_ids is None:
+        return db.index.search(vectors, k)
+    selected = opportunity_positions(db, allowed_ids, positions)
+    if not len(selected):
+        return (
+            np.full((len(vectors), k), np.inf, dtype=np.float32),
+            np.full((len(vectors), k), -1, dtype=np.int64),
+        )
+    return search_positions(db, vectors, min(k, len(selected)), selected)
+
+
+def ranked_opportunities(db, distances, positions, k=10):
+    """Collapse chunk hits into the k best distinct opportunities per query.
+
+    A chunk shared by several grants counts as a hit for each of them.
+    """
+    results = []
+    for row_distances, row_positions in zip(distances, positions):
+        best = {}
+        for distance, position in zip(row_distances, row_positions):
+            if position < 0:
+                continue
+            doc = db.docstore.search(db.index_to_docstore_id[position])
+            for opp_id in chunk_opportunities(doc):
+                best.setdefault(opp_id, float(distance))
+            if len(best) >= k:
+                break
+        results.append(list(best.items())[:k])
+    return results
+
+
+def embed_profiles(embedding_function, texts, vectors=None) -> np.ndarray:
+    if vectors is None:
+        vectors = embedding_function.embed_documents(texts)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def match_profiles(
+    db,
+    embedding_function,
+    texts,
+    k=10,
+    batch_size=64,
+    workers=4,
+    allowed_ids=None,
+    vectors=None,
+    positions=None,
+):
+    """Return ranked `(opportunity_id, distance)` lists, one per profile text.
+
+    Profiles are embedded in one batched call (unless their `vectors` are
+    given), then searched against the index `batch_size` queries at a time
+    across a pool of `workers` threads (FAISS releases the GIL while
+    searching). `allowed_ids` restricts scoring to those opportunities,
+    looked up in `positions` (see `position_map`, built once if not given).
+    """
+    vectors = embed_profiles(embedding_function, texts, vectors)
+    fetch_k = min(k * 4, db.index.ntotal)
+    if allowed_ids is not None and positions is None:
+        positions = position_map(db)
+
+    def run(start):
+        distances, hits = search_vectors(
+            db, vectors[start : start + batch_size], fetch_k, allowed_ids, positions
+        )
+        return ranked_opportunities(db, distances, hits, k)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = executor.map(run, range(0, len(vectors), batch_size))
+        return [matches for batch in batches for matches in batch]
+
+
+def hybrid_match(
+    db,
+    embedding_function,
+    lexical,
+    texts,
+    k=10,
+    shortlist=100,
+    lexical_weight=0.5,
+    workers=4,
+    allowed_ids=None,
+    vectors=None,
+    positions=None,
+):
+    """Rank opportunities by fusing BM25 and dense vector rankings.
+
+    For each profile the BM25 index `lexical` shortlists up to `shortlist`
+    opportunities and their chunks are scored against the profile vector.
+    The dense ranking covers the shortlist plus the dense top `k`, so a short
+    or empty shortlist still yields `k` results. The two rankings are
+    combined with reciprocal rank fusion, with `lexical_weight` weighting the
+    BM25 side. `positions` is the index's `position_map`, built if not
+    given. Returns `(opportunity_id, distance)` lists in fused order, like
+    `match_profiles`.
+    """
+    vectors = embed_profiles(embedding_function, texts, vectors)
+    positions = position_map(db) if positions is None else positions
+    fetch_k = min(k * 4, db.index.ntotal)
+
+    def run(i):
+        vector = vectors[i : i + 1]
+        distances, hits = search_vectors(db, vector, fetch_k, allowed_ids, positions)
+        dense = dict(ranked_opportunities(db, distances, hits, k)[0])
+        candidates = lexical.search(texts[i], shortlist, allowed_ids)
+        selected = opportunity_positions(
+            db, [opp_id for opp_id, _ in candidates], positions
+        )
+        if len(selected):
+            distances, hits = search_positions(db, vector, len(selected), selected)
+            shortlisted = ranked_opportunities(db, distances, hits, len(candidates))
+            dense.update(shortlisted[0])
+
+        fused = defaultdict(float)
+        for rank, (opp_id, _) in enumerate(candidates, start=1):
+            fused[opp_id] += lexical_weight / (RRF_K + rank)
+        for rank, opp_id in enumerate(sorted(dense, key=dense.get), start=1):
+            fused[opp_id] += (1 - lexical_weight) / (RRF_K + rank)
+        ranked = sorted(dense, key=fused.get, reverse=True)
+        return [(opp_id, dense[opp_id]) for opp_id in ranked[:k]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, range(len(texts))))
+
+
+def cached_matches(cache, embedding_function, texts, index_version, params, match):
+    """Serve repeat profiles from `cache`, running `match` only for the rest.
+
+    `match(texts, vectors)` returns ranked matches for the given profiles.
+    Cached query embeddings are reused even when the index build has changed,
+    so only profiles never seen before are embedded.
+    """
+    model = embedding_model_name(embedding_function)
+    results, vectors, misses = [None] * len(texts), {}, []
+    for i, text in enumerate(texts):
+        vector, matches = cache.lookup(text, model, index_version, params)
+        if matches is not None:
+            results[i] = matches
+            continue
+        misses.append(i)
+        if vector is not None:
+            vectors[i] = vector
+    incr("match.cache_hits", len(texts) - len(misses))
+    incr("match.cache_misses", len(misses))
+
+    if misses:
+        unknown = [i for i in misses if i not in vectors]
+        if unknown:
+            embedded = embed_profiles(embedding_function, [texts[i] for i in unknown])
+            vectors.update(zip(unknown, embedded))
+        computed = match(
+            [texts[i] for i in misses], np.stack([vectors[i] for i in misses])
+        )
+        for i, matches in zip(misses, computed):
+            cache.store(texts[i], model, index_version, params, vectors[i], matches)
+            results[i] = matches
+    cache.flush()
+    return results
+
+
+def batch_match(
+    profiles_path,
+    output_path,
+    db=None,
+    embedding_function=None,
+    k=10,
+    batch_size=64,
+    workers=4,
+    provider="huggingface",
+    index_dir=INDEX_DIR,
+    filters=None,
+    eligibility_path=ELIGIBILITY_INDEX_PATH,
+    hybrid=False,
+    shortlist=100,
+    bm25_dir=BM25_INDEX_DIR,
+    opportunity_ids=None,
+    result_cache=None,
+):
+    """Match every profile in `profiles_path` against the grant index.
+
+    `profiles_path` is a CSV with `profile_id` and `description` columns. Each
+    profile's top `k` opportunities are written to `output_path` as one row per
+    match with its rank and distance (lower is closer). `filters` are keyword
+    arguments for `EligibilityIndex.query`; only eligible grants are scored.
+    With `hybrid`, a BM25 shortlist of `shortlist` grants is fused with dense
+    scores (see `hybrid_match`). `opportunity_ids` limits matching to those
+    grants, e.g. the ones added or changed since the last digest.
+
+    With a `result_cache` (see `ResultCache`), profiles already matched
+    against the current index build (and BM25 build, with `hybrid`) are
+    answered from the cache. Caching needs a known build, so it only applies
+    when the index is loaded here.
+    """
+    if embedding_function is None:
+        embedding_function = get_embedding_function(provider=provider)
+    index_version = None
+    if db is None:
+        db, manifest = load_index(index_dir, embedding_function)
+        if db is None:
+            raise FileNotFoundError(
+                f"No index build found in {os.path.abspath(index_dir)}; "
+                "build it with pipeline.py first"
+            )
+        index_version = build_version(manifest)
+
+    profiles = pd.read_csv(profiles_path, dtype={"profile_id": str})
+    texts = profiles["description"].fillna("").astype(str).tolist()
+    allowed_ids = None if opportunity_ids is None else set(map(str, opportunity_ids))
+    if filters:
+        eligible = EligibilityIndex.load(eligibility_path).query(**filters)
+        print(f"{len(eligible)} opportunities match the eligibility filters")
+        allowed_ids = eligible if allowed_ids is None else allowed_ids & eligible
+    positions = position_map(db) if hybrid or allowed_ids is not None else None
+    if hybrid:
+        lexical = BM25Index.load(bm25_dir)
+        if index_version is not None:
+            index_version += f"+bm25@{lexical.version}"
+
+        def match(texts, vectors=None):
+            return hybrid_match(
+                db,
+                embedding_function,
+                lexical,
+                texts,
+                k,
+                shortlist,
+                workers=workers,
+                allowed_ids=allowed_ids,
+                vectors=vectors,
+                positions=positions,
+            )
+
+    else:
+
+        def match(texts, vectors=None):
+            return match_profiles(
+                db,
+                embedding_function,
+                texts,
+                k,
+                batch_size,
+                workers,
+                allowed_ids,
+                vectors,
+                positions,
+            )
+
+    if result_cache is not None and index_version is not None:
+        params = params_key(
+            index_dir=os.path.abspath(index_dir),
+            k=k,
+            hybrid=hybrid,
+            shortlist=shortlist,
+            allowed_ids=allowed_ids,
+        )
+        matches = cached_matches(
+            result_cache, embedding_function, texts, index_version, params, match
+        )
+    else:
+        matches = match(texts)
+
+    with open(output_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=MATCH_FIELDS)
+        writer.writeheader()
+        for profile_id, ranked in zip(profiles["profile_id"], matches):
+            writer.writerows(
+                {
+                    "profile_id": profile_id,
+                    "rank": rank,
+                    "opportunity_id": opp_id,
+                    "distance": f"{distance:.6f}",
+                }
+                for rank, (opp_id, distance) in enumerate(ranked, start=1)
+            )
+    print(f"Matches for {len(profiles)} profiles have been written to {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match business profiles to grants")
+    parser.add_argument("profiles", help="CSV with profile_id and description columns")
+    parser.add_argument("output", help="CSV file to write ranked matches to")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--provider", default="huggingface")
+    parser.add_argument("--applicant-type", action="append", dest="applicant_types")
+    parser.add_argument("--agency", action="append", dest="agencies")
+    parser.add_argument("--instrument", action="append", dest="funding_instruments")
+    parser.add_argument("--open-on", type=date.fromisoformat)
+    parser.add_argument(
+        "--hybrid", action="store_true", help="fuse BM25 and dense rankings"
+    )
+    parser.add_argument("--shortlist", type=int, default=100)
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not use the match result cache"
+    )
+    args = parser.parse_args()
+
+    filters = {
+        name: getattr(args, name)
+        for name in ("applicant_types", "agencies", "funding_instruments", "open_on")
+        if getattr(args, name) is not None
+    }
+
+    batch_match(
+        args.profiles,
+        args.output,
+        k=args.k,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        provider=args.provider,
+        filters=filters,
+        hybrid=args.hybrid,
+        shortlist=args.shortlist,
+        result_cache=None if args.no_cache else ResultCache(RESULT_CACHE_PATH),
+    )
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+from download_news_grants import (
+    eligibility_extractor,
+    incremental_crawl,
+    iter_grant_list,
+    output_csv,
+)
+from lang_recommender import data_processing, get_documents, text_embedding
+from utils.bm25_index import BM25_INDEX_DIR, build_bm25_index
+from utils.compact_index import INDEX_TYPES
+from utils.details_store import DETAILS_PATH
+from utils.eligibility_index import ELIGIBILITY_INDEX_PATH, build_eligibility_index
+from utils.metrics import incr, metrics, profiled, timed
+from utils.vector_index import CURRENT_FILE, INDEX_DIR
+
+DATA_DIR = "src/data"
+SYNOPSIS_DIR = "src/data/synopsis"
+GRANTS_PATH = "src/data/grants.json"
+STATE_PATH = "src/data/pipeline_state.json"
+
+
+@dataclass
+class Stage:
+    """One pipeline step with declared file inputs and outputs.
+
+    Paths may contain `{date}`, which is filled in with the run date. A stage
+    is skipped when its outputs exist and the content hash of its inputs (and
+    the run date, if its paths depend on it) matches the previous run.
+    `params` are the settings `func` was built with; changing them also
+    reruns the stage. Stages with `always_run` read from the network, so they
+    have no local inputs to hash and run every time. A failing `optional`
+    stage is logged and the run goes on with whatever its outputs held before.
+    """
+
+    name: str
+    func: Callable[[str], None]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    after: List[str] = field(default_factory=list)
+    always_run: bool = False
+    optional: bool = False
+    params: Dict[str, object] = field(default_factory=dict)
+
+
+def hash_path(path: str, digest) -> None:
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                hash_path(os.path.join(root, name), digest)
+        return
+    digest.update(path.encode("utf-8"))
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+
+
+def fingerprint(stage: Stage, run_date: str) -> str:
+    digest = hashlib.sha256(stage.name.encode("utf-8"))
+    if any("{date}" in path for path in stage.inputs + stage.outputs):
+        digest.update(run_date.encode("utf-8"))
+    if stage.params:
+        digest.update(json.dumps(stage.params, sort_keys=True).encode("utf-8"))
+    for path in stage.inputs:
+        hash_path(path.format(date=run_date), digest)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """Runs stages in dependency order, overlapping independent ones.
+
+    Each stage starts as soon as the stages it runs `after` have finished, on
+    a pool of `workers` threads. Input fingerprints of completed stages are
+    kept in `state_path` so unchanged stages are skipped on the next run.
+    """
+
+    def __init__(self, stages: List[Stage], state_path=STATE_PATH, workers=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+        self.workers = workers
+
+    def _load_state(self) -> Dict[str, str]:
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: Dict[str, str]):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(state, file, indent=4)
+        os.replace(tmp, self.state_path)
+
+    def _run_stage(self, stage: Stage, run_date: str, previous, force: bool):
+        """Run `stage` unless it is up to date; return its new fingerprint."""
+        outputs = [path.format(date=run_date) for path in stage.outputs]
+        if not stage.always_run and not force:
+            key = fingerprint(stage, run_date)
+            if previous == key and all(map(os.path.exists, outputs)):
+                print(f"[{stage.name}] inputs unchanged, skipping")
+                return key
+
+        print(f"[{stage.name}] running")
+        try:
+            with timed(f"stage.{stage.name}"), profiled(f"stage-{stage.name}"):
+                stage.func(run_date)
+        except Exception as e:
+            if not stage.optional:
+                raise
+            incr(f"stage.{stage.name}.failures")
+            print(f"[{stage.name}] failed, continuing with previous outputs: {e!r}")
+            return None
+        return None if stage.always_run else fingerprint(stage, run_date)
+
+    def _run_stages(self, run_date: str, state: Dict[str, str], force, only):
+        selected = set(only or self.stages)
+        done, running = set(), {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(done) < len(self.stages):
+                for name, stage in self.stages.items():
+                    if name in done or name in running.values():
+                        continue
+                    if not all(dep in done for dep in stage.after):
+                        continue
+                    if name not in selected:
+                        done.add(name)
+                        continue
+                    future = executor.submit(
+                        self._run_stage, stage, run_date, state.get(name), force
+                    )
+                    running[future] = name
+
+                if not running:
+                    if len(done) < len(self.stages):
+                        pending = sorted(set(self.stages) - done)
+                        raise ValueError(f"Unsatisfiable dependencies: {pending}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    key = future.result()
+                    if key is not None:
+                        state[name] = key
+                    done.add(name)
+                    self._save_state(state)
+
+    def run(self, run_date: Optional[str] = None, force=False, only=None):
+        """Run the pipeline for `run_date` (YYYY-MM-DD, default today).
+
+        Metrics are emitted when the run ends, labelled with its status, also
+        when a stage fails.
+        """
+        run_date = run_date or date.today().strftime("%Y-%m-%d")
+        state = self._load_state()
+        metrics.reset()
+        status = "failed"
+        try:
+            self._run_stages(run_date, state, force, only)
+            status = "ok"
+        finally:
+            metrics.emit(run_date=run_date, status=status)
+
+
+def fetch_list(run_date):
+    with open(GRANTS_PATH, "w") as file:
+        json.dump(list(iter_grant_list()), file, indent=4)
+
+
+def crawl_details(run_date):
+    with open(GRANTS_PATH) as file:
+        incremental_crawl(json.load(file))
+
+
+def refresh_eligibilities(run_date):
+    asyncio.run(eligibility_extractor())
+
+
+def embed_documents(run_date, index_type=None):
+    combined = f"{SYNOPSIS_DIR}/{run_date}-combined.csv"
+    text_embedding(
+        get_documents(combined),
+        data_dir=DATA_DIR,
+        today=run_date,
+        index_type=index_type,
+    )
+
+
+def default_stages(index_type=None) -> List[Stage]:
+    """Return the pipeline stages; `index_type` picks the compact index export."""
+    synopsis = f"{SYNOPSIS_DIR}/{{date}}.csv"
+    combined = f"{SYNOPSIS_DIR}/{{date}}-combined.csv"
+    return [
+        Stage(
+            "eligibilities", refresh_eligibilities, always_run=True, optional=True
+        ),
+        Stage("list", fetch_list, outputs=[GRANTS_PATH], always_run=True),
+        Stage(
+            "details",
+            crawl_details,
+            inputs=[GRANTS_PATH],
+            outputs=[DETAILS_PATH],
+            after=["list"],
+        ),
+        Stage(
+            "synopsis",
+            lambda run_date: output_csv(SYNOPSIS_DIR, run_date),
+            inputs=[DETAILS_PATH],
+            outputs=[synopsis],
+            after=["details"],
+        ),
+        Stage(
+            "eligibility_index",
+            lambda run_date: build_eligibility_index(),
+            inputs=[DETAILS_PATH],
+            outputs=[ELIGIBILITY_INDEX_PATH],
+            after=["details"],
+        ),
+        Stage(
+            "combined",
+            lambda run_date: data_processing(SYNOPSIS_DIR, run_date),
+            inputs=[synopsis],
+            outputs=[combined],
+            after=["synopsis"],
+        ),
+        Stage(
+            "bm25",
+            lambda run_date: build_bm25_index(combined.format(date=run_date)),
+            inputs=[combined],
+            outputs=[os.path.join(BM25_INDEX_DIR, CURRENT_FILE)],
+            after=["combined"],
+        ),
+        Stage(
+            "embed",
+            lambda run_date: embed_documents(run_date, index_type),
+            inputs=[combined],
+            outputs=[os.path.join(INDEX_DIR, CURRENT_FILE)],
+            after=["combined"],
+            params={"index_type": index_type},
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the grants digest pipeline")
+    parser.add_argument("--date", help="run date as YYYY-MM-DD (default: today)")
+    parser.add_argument("--force", action="store_true", help="ignore stage caching")
+    parser.add_argument("--only", nargs="+", help="run only these stages")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        help="also export a compact index of this type for matching",
+    )
+    args = parser.parse_args()
+
+    Pipeline(default_stages(args.index_type), workers=args.workers).run(
+        args.date, force=args.force, only=args.only
+    )
@@ -1,12 +1,13 @@
 # imports
+import atexit
+
 import pandas as pd
-import pickle
 
+from utils.embedding_cache import EMBEDDING_CACHE_PATH, EmbeddingCache
+from utils.embedding_service import EmbeddingService, openai_backend
 from utils.embeddings_utils import (
     get_embedding,
     distances_from_embeddings,
-    tsne_components_from_embeddings,
-    chart_from_components,
     indices_of_nearest_neighbors_from_distances,
 )
 
@@ -21,18 +22,10 @@ def load_data(dataset_path="src/data/output.csv", n=10):
 
 
 # establish a cache of embeddings to avoid recomputing
-# cache is a dict of tuples (text, model) -> embedding, saved as a pickle file
-
-# set path to embedding cache
-embedding_cache_path = "src/data/recommendations_embeddings_cache.pkl"
+# cache maps (text, model) -> embedding and is stored in SQLite, opened on first use
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+atexit.register(embedding_cache.close)
 
-# load the cache if it exists, and save a copy to disk
-try:
-    embedding_cache = pd.read_pickle(embedding_cache_path)
-except FileNotFoundError:
-    embedding_cache = {}
-with open(embedding_cache_path, "wb") as embedding_cache_file:
-    pickle.dump(embedding_cache, embedding_cache_file)
 
 # define a function to retrieve embeddings from the cache if present, and otherwise request via the API
 def embedding_from_string(
@@ -41,13 +34,21 @@ def embedding_from_string(
     embedding_cache=embedding_cache
 ) -> list:
     """Return embedding of given string, using a cache to avoid recomputing."""
-    if (string, model) not in embedding_cache.keys():
+    if (string, model) not in embedding_cache:
         embedding_cache[(string, model)] = get_embedding(string, model)
-        with open(embedding_cache_path, "wb") as embedding_cache_file:
-            pickle.dump(embedding_cache, embedding_cache_file)
     return embedding_cache[(string, model)]
 
 
+def embeddings_from_strings(
+    strings: list[str],
+    model: str = EMBEDDING_MODEL,
+    embedding_cache=embedding_cache,
+) -> list:
+    """Return embeddings of the given strings in a few batched API calls."""
+    service = EmbeddingService(openai_backend(model), model, cache=embedding_cache)
+    return service.embed(strings)
+
+
 def print_recommendations_from_strings(
     strings: list[str],
     index_of_source_string: int,
@@ -56,7 +57,7 @@ def print_recommendations_from_strings(
 ) -> list[int]:
     """Print out the k nearest neighbors of a given string."""
     # get embeddings for all strings
-    embeddings = [embedding_from_string(string, model=model) for string in strings]
+    embeddings = embeddings_from_strings(strings, model=model)
     # get the embedding of the source string
     query_embedding = embeddings[index_of_source_string]
     # get distances between the source embedding and other embeddings (function from utils.embeddings_utils.py)
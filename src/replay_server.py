@@ -0,0 +1,44 @@
+import argparse
+import time
+
+from utils.http_replay import HTTP_ARCHIVE_PATH, HttpArchive, ReplayServer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve recorded grants.gov responses for offline crawler runs"
+    )
+    parser.add_argument("--archive", default=HTTP_ARCHIVE_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503s")
+    parser.add_argument(
+        "--drop-rate", type=float, default=0.0, help="share of dropped connections"
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = ReplayServer(
+        args.archive,
+        args.host,
+        args.port,
+        args.latency_ms / 1000,
+        args.jitter_ms / 1000,
+        args.error_rate,
+        args.drop_rate,
+        args.seed,
+    ).start()
+    print(
+        f"Replaying {len(HttpArchive(args.archive))} responses on {server.url}; "
+        f"run the crawler with GRANTS_HTTP_MODE=replay "
+        f"GRANTS_HTTP_REPLAY_URL={server.url}"
+    )
+    try:
+        while True:
+            time.sleep(60)
+            print(server.stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+from array import array
+from collections import Counter, defaultdict
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.chunking import iter_rows
+
+BM25_INDEX_DIR = "src/data/grants_db/bm25"
+CURRENT_FILE = "CURRENT"
+VOCAB_FILE = "vocab.json"
+DOCS_FILE = "postings_docs.npy"
+TFS_FILE = "postings_tfs.npy"
+LENGTHS_FILE = "doc_lengths.npy"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "their this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """Yield lowercase terms, keeping codes like `10.001` or `HHS-NIH11` whole.
+
+    Compound codes are also split into their parts, so `NIH11` matches too.
+    """
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        yield token
+        parts = re.split(r"[.\-/]", token)
+        if len(parts) > 1:
+            yield from (part for part in parts if part not in STOPWORDS)
+
+
+class BM25Index:
+    """Okapi BM25 over one combined description per opportunity.
+
+    Postings are stored as two flat arrays (document rows and term
+    frequencies) sliced by per-term offsets, saved as `.npy` files and
+    memory-mapped on load, so opening the index costs little more than
+    reading the vocabulary. `version` is a content hash of the index, saved
+    with it. Each save is a complete directory named after the version, and a
+    CURRENT file in the index directory points at the live one.
+    """
+
+    def __init__(
+        self, ids, terms, offsets, docs, tfs, lengths, k1=1.5, b=0.75, version=None
+    ):
+        self.ids = ids
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.rows = {opp_id: row for row, opp_id in enumerate(ids)}
+        average = float(np.mean(lengths)) if len(lengths) else 1.0
+        self.norms = (k1 * (1 - b + b * np.asarray(lengths) / average)).astype(
+            np.float32
+        )
+        self._version = version
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            digest = hashlib.sha256()
+            terms = sorted(self.terms, key=self.terms.get)
+            digest.update(json.dumps([self.ids, terms, self.k1, self.b]).encode())
+            for values in (self.offsets, self.docs, self.tfs, self.lengths):
+                digest.update(np.ascontiguousarray(values).tobytes())
+            self._version = digest.hexdigest()[:16]
+        return self._version
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, str]], k1=1.5, b=0.75) -> "BM25Index":
+        """Build from `(opportunity_id, text)` rows, streaming them once."""
+        ids, lengths = [], array("i")
+        postings = defaultdict(lambda: (array("i"), array("H")))
+        for row, (opp_id, text) in enumerate(rows):
+            counts = Counter(tokenize(text))
+            ids.append(opp_id)
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                docs, tfs = postings[term]
+                docs.append(row)
+                tfs.append(min(count, 0xFFFF))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term][0])
+        docs = np.fromiter(
+            (row for term in terms for row in postings[term][0]),
+            dtype=np.int32,
+            count=offsets[-1],
+        )
+        tfs = np.fromiter(
+            (tf for term in terms for tf in postings[term][1]),
+            dtype=np.uint16,
+            count=offsets[-1],
+        )
+        terms = {term: i for i, term in enumerate(terms)}
+        return cls(ids, terms, offsets, docs, tfs, np.array(lengths), k1, b)
+
+    @classmethod
+    def load(cls, path=BM25_INDEX_DIR) -> "BM25Index":
+        try:
+            with open(os.path.join(path, CURRENT_FILE)) as file:
+                path = os.path.join(path, file.read().strip())
+        except FileNotFoundError:
+            pass  # saved before builds were versioned
+        with open(os.path.join(path, VOCAB_FILE)) as file:
+            vocab = json.load(file)
+        return cls(
+            vocab["ids"],
+            {term: i for i, term in enumerate(vocab["terms"])},
+            np.array(vocab["offsets"], dtype=np.int64),
+            np.load(os.path.join(path, DOCS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, TFS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, LENGTHS_FILE)),
+            vocab["k1"],
+            vocab["b"],
+            vocab.get("version"),
+        )
+
+    def save(self, path=BM25_INDEX_DIR):
+        """Write a new build directory and atomically point CURRENT at it.
+
+        Readers either load the previous build or the new one, never a mix of
+        both. Builds older than the previous one are removed.
+        """
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, CURRENT_FILE)) as file:
+                previous = file.read().strip()
+        except FileNotFoundError:
+            previous = None
+        version = self.version
+        build = os.path.join(path, version)
+        if not os.path.isdir(build):
+            # build directories only appear complete, by renaming
+            tmp = tempfile.mkdtemp(prefix=".tmp-", dir=path)
+            terms = sorted(self.terms, key=self.terms.get)
+            vocab = {
+                "ids": self.ids,
+                "terms": terms,
+                "offsets": self.offsets.tolist(),
+                "k1": self.k1,
+                "b": self.b,
+                "version": version,
+            }
+            np.save(os.path.join(tmp, DOCS_FILE), np.asarray(self.docs))
+            np.save(os.path.join(tmp, TFS_FILE), np.asarray(self.tfs))
+            np.save(os.path.join(tmp, LENGTHS_FILE), np.asarray(self.lengths))
+            with open(os.path.join(tmp, VOCAB_FILE), "w") as file:
+                json.dump(vocab, file)
+            try:
+                os.rename(tmp, build)
+            except OSError:
+                # a concurrent save of the same content got there first
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        tmp = os.path.join(path, CURRENT_FILE + ".tmp")
+        with open(tmp, "w") as file:
+            file.write(version)
+        os.replace(tmp, os.path.join(path, CURRENT_FILE))
+
+        for name in os.listdir(path):
+            stale = os.path.join(path, name)
+            if name in (version, previous) or name.startswith("."):
+                continue
+            if os.path.isdir(stale):
+                shutil.rmtree(stale, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Return the BM25 score of every opportunity for `query`."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (len(self.ids) - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self.norms[docs])
+        return scores
+
+    def search(
+        self, query: str, k=100, allowed_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Return up to `k` `(opportunity_id, score)` pairs, best first.
+
+        Only opportunities sharing at least one term with `query` are returned.
+        """
+        scores = self.scores(query)
+        if allowed_ids is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            rows = [self.rows[i] for i in map(str, allowed_ids) if i in self.rows]
+            mask[rows] = True
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in candidates]
+
+
+def build_bm25_index(csv_path, path=BM25_INDEX_DIR) -> BM25Index:
+    """Build the BM25 index from a combined descriptions CSV and save it."""
+    index = BM25Index.build(iter_rows(csv_path))
+    index.save(path)
+    return index
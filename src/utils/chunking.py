@@ -0,0 +1,159 @@
+import csv
+import hashlib
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from utils.encoding import get_encoding
+from utils.metrics import incr
+
+SECTION_PATTERN = re.compile(
+    r"(?=Applicant Eligibility Description:|Applicant Types:)"
+)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+WORD_PATTERN = re.compile(r"\w+")
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 6
+NEAR_DUPLICATE_DISTANCE = 5
+NEAR_DUPLICATE_MIN_WORDS = 24
+
+
+def chunk_opportunities(doc) -> List[str]:
+    """Return every opportunity id a (possibly shared) chunk belongs to."""
+    return [str(opp_id) for opp_id in doc.metadata.get("opportunities", [])] or [
+        str(doc.metadata["source"])
+    ]
+
+
+def split_text(text: str, max_tokens=256, encoding=None) -> Iterator[str]:
+    """Split `text` into chunks of at most `max_tokens` tokens.
+
+    Each section of a combined description (synopsis, eligibility, applicant
+    types) is chunked on its own and chunks end on sentence boundaries where
+    possible, so boilerplate shared between grants yields identical chunks.
+    """
+    encoding = encoding or get_encoding()
+    for section in SECTION_PATTERN.split(text):
+        current, current_tokens = [], 0
+        for sentence in SENTENCE_PATTERN.split(section.strip()):
+            if not sentence:
+                continue
+            tokens = len(encoding.encode(sentence))
+            if current and current_tokens + tokens > max_tokens:
+                yield " ".join(current)
+                current, current_tokens = [], 0
+            if tokens <= max_tokens:
+                current.append(sentence)
+                current_tokens += tokens
+                continue
+            ids = encoding.encode(sentence)
+            for start in range(0, len(ids), max_tokens):
+                yield encoding.decode(ids[start : start + max_tokens])
+        if current:
+            yield " ".join(current)
+
+
+def normalize_chunk(text: str) -> str:
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def simhash(text: str, shingle=2) -> int:
+    """64-bit SimHash of the word shingles of `text`."""
+    words = text.split()
+    grams = [
+        " ".join(words[i : i + shingle]).encode("utf-8")
+        for i in range(max(len(words) - shingle + 1, 1))
+    ]
+    values = np.frombuffer(
+        b"".join(hashlib.blake2b(gram, digest_size=8).digest() for gram in grams),
+        dtype=">u8",
+    ).astype(np.uint64)
+    bits = (values[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & 1
+    weights = 2 * bits.sum(axis=0, dtype=np.int64) - len(values)
+    return sum(1 << int(bit) for bit in np.flatnonzero(weights > 0))
+
+
+class ChunkDeduplicator:
+    """Detect exact and near-duplicate chunks across grants.
+
+    Exact duplicates are found by hashing the normalised text; near duplicates
+    by SimHash, bucketed on `SIMHASH_BANDS` bands so that any two hashes within
+    `NEAR_DUPLICATE_DISTANCE` bits share at least one bucket.
+    """
+
+    def __init__(self, near=True):
+        self.near = near
+        self.exact: Dict[str, Document] = {}
+        self.buckets: Dict[Tuple[int, int], List[Tuple[int, Document]]] = {}
+
+    def _bands(self, value: int):
+        width = -(-SIMHASH_BITS // SIMHASH_BANDS)
+        mask = (1 << width) - 1
+        return [
+            (band, value >> (band * width) & mask) for band in range(SIMHASH_BANDS)
+        ]
+
+    def find(self, normalized: str):
+        """Return the kept chunk that `normalized` duplicates, if any."""
+        key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        if key in self.exact:
+            return self.exact[key], "exact", key, None
+        if not self.near or normalized.count(" ") + 1 < NEAR_DUPLICATE_MIN_WORDS:
+            return None, None, key, None
+        value = simhash(normalized)
+        for band in self._bands(value):
+            for other, doc in self.buckets.get(band, ()):
+                if bin(value ^ other).count("1") <= NEAR_DUPLICATE_DISTANCE:
+                    return doc, "near", key, value
+        return None, None, key, value
+
+    def keep(self, doc: Document, key: str, value=None):
+        self.exact[key] = doc
+        if value is not None:
+            for band in self._bands(value):
+                self.buckets.setdefault(band, []).append((value, doc))
+
+
+def iter_rows(csv_path, id_column="opportunity_id", text_column="description"):
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            yield str(row[id_column]).strip(), (row.get(text_column) or "").strip()
+
+
+def chunk_documents(
+    rows: Iterable[Tuple[str, str]], max_tokens=256, dedup=True, near=True
+) -> List[Document]:
+    """Return the chunk documents for `(opportunity_id, text)` rows.
+
+    Each chunk's metadata holds the `source` opportunity and an `opportunities`
+    list of every grant sharing that text. Duplicate chunks are dropped and
+    their opportunity is added to the list of the chunk kept, which may come
+    from any earlier row, so the documents are only complete once every row
+    has been read. Rows are read one at a time.
+    """
+    encoding = get_encoding()
+    deduplicator = ChunkDeduplicator(near) if dedup else None
+    docs = []
+    for opp_id, text in rows:
+        for i, chunk in enumerate(split_text(text, max_tokens, encoding)):
+            incr("chunks.total")
+            doc = Document(
+                page_content=chunk,
+                metadata={"source": opp_id, "chunk": i, "opportunities": [opp_id]},
+            )
+            if deduplicator is None:
+                docs.append(doc)
+                continue
+
+            kept, kind, key, value = deduplicator.find(normalize_chunk(chunk))
+            if kept is None:
+                deduplicator.keep(doc, key, value)
+                docs.append(doc)
+                continue
+            incr(f"chunks.duplicates_{kind}")
+            if opp_id not in kept.metadata["opportunities"]:
+                kept.metadata["opportunities"].append(opp_id)
+    return docs
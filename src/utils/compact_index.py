@@ -0,0 +1,231 @@
+import json
+import mmap
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+import faiss
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.schema import Document
+from langchain.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "fp16", "int8", "pq", "ivf", "ivfpq", "hnsw")
+
+DOCS_FILE = "docs.jsonl"
+OFFSETS_FILE = "offsets.npy"
+FAISS_FILE = "index.faiss"
+META_FILE = "compact.json"
+
+
+def _pq_subquantizers(dim: int) -> int:
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0 and m <= dim // 4:
+            return m
+    return 1
+
+
+def index_factory_string(index_type: str, n_vectors: int, dim: int) -> str:
+    """Return the FAISS factory string for `index_type` sized for the corpus."""
+    nlist = max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+    # at least 4 dimensions per sub-quantizer: faiss' 2-dimension PQ kernels
+    # need 8+ centroids, which small corpora cannot train
+    m = _pq_subquantizers(dim)
+    # PQ codebooks need at least 2**nbits training points; polysemous training
+    # ("np" disables it) only helps Hamming-filtered search and is very slow
+    nbits = int(max(1, min(8, np.log2(max(n_vectors, 2)))))
+    factories = {
+        "flat": "Flat",
+        "fp16": "SQfp16",
+        "int8": "SQ8",
+        "pq": f"PQ{m}x{nbits}np",
+        "ivf": f"IVF{nlist},Flat",
+        "ivfpq": f"IVF{nlist},PQ{m}x{nbits}np",
+        "hnsw": "HNSW32",
+    }
+    if index_type not in factories:
+        raise ValueError(
+            f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}"
+        )
+    return factories[index_type]
+
+
+def build_faiss_index(
+    vectors: np.ndarray, index_type="flat", nprobe=16, max_train=50_000
+):
+    """Build and train a FAISS index of `index_type` over `vectors` (L2).
+
+    Quantizers are trained on a random sample of at most `max_train` vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, index_factory_string(index_type, n, dim))
+    if not index.is_trained:
+        sample = np.random.default_rng(0).permutation(n)[:max_train]
+        index.train(vectors[np.sort(sample)])
+    index.add(vectors)
+    if index_type.startswith("ivf"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    return index
+
+
+class MmapDocstore(Docstore):
+    """Read-only docstore over a JSON-lines file, memory-mapped on open.
+
+    Only the byte offsets of each record are loaded; a document is decoded
+    when it is looked up, so opening a large store costs almost nothing.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(os.path.join(path, DOCS_FILE), "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(path, META_FILE)) as file:
+            self._positions = {
+                doc_id: i for i, doc_id in enumerate(json.load(file)["ids"])
+            }
+
+    def search(self, search: str):
+        position = self._positions.get(search)
+        if position is None:
+            return f"ID {search} not found."
+        start, end = self._offsets[position], self._offsets[position + 1]
+        record = json.loads(self._data[start:end])
+        return Document(
+            page_content=record["page_content"], metadata=record["metadata"]
+        )
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise NotImplementedError("MmapDocstore is read-only")
+
+    def delete(self, ids: List) -> None:
+        raise NotImplementedError("MmapDocstore is read-only")
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact_index_type(path: str) -> Optional[str]:
+    """Return the index type of the compact build in `path`, if there is one."""
+    try:
+        with open(os.path.join(path, META_FILE)) as file:
+            return json.load(file)["index_type"]
+    except FileNotFoundError:
+        return None
+
+
+def export_compact(db: FAISS, path: str, index_type="flat") -> str:
+    """Write `db` as a compressed, pickle-free build in `path`.
+
+    Vectors are re-indexed with `index_type`; documents go to a JSON-lines
+    file with a separate offsets array so they can be memory-mapped.
+    """
+    os.makedirs(path, exist_ok=True)
+    ids = [db.index_to_docstore_id[i] for i in range(db.index.ntotal)]
+    vectors = db.index.reconstruct_n(0, db.index.ntotal)
+    index = build_faiss_index(vectors, index_type)
+    faiss.write_index(index, os.path.join(path, FAISS_FILE))
+
+    offsets = [0]
+    with open(os.path.join(path, DOCS_FILE), "wb") as file:
+        for doc_id in ids:
+            doc = db.docstore.search(doc_id)
+            line = json.dumps(
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+            ).encode("utf-8")
+            file.write(line + b"\n")
+            offsets.append(offsets[-1] + len(line) + 1)
+    np.save(os.path.join(path, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+
+    with open(os.path.join(path, META_FILE), "w") as file:
+        json.dump({"index_type": index_type, "ids": ids}, file)
+    return path
+
+
+def load_compact(path: str, embedding_function, mmap_index=True) -> FAISS:
+    """Load a build written by `export_compact` without unpickling anything.
+
+    The returned store's docstore keeps the documents file open; call
+    `db.docstore.close()` when done with it.
+    """
+    flags = faiss.IO_FLAG_MMAP if mmap_index else 0
+    try:
+        index = faiss.read_index(os.path.join(path, FAISS_FILE), flags)
+    except RuntimeError:
+        # not every index type supports memory-mapped reads
+        index = faiss.read_index(os.path.join(path, FAISS_FILE))
+    docstore = MmapDocstore(path)
+    with open(os.path.join(path, META_FILE)) as file:
+        ids = json.load(file)["ids"]
+    return FAISS(embedding_function, index, docstore, dict(enumerate(ids)))
+
+
+def index_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k=10,
+    index_types: Iterable[str] = INDEX_TYPES,
+    nprobe=16,
+) -> List[dict]:
+    """Compare index types on recall@k, query latency, build time and size.
+
+    Recall is measured against exact (flat) search over the same vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, index_type, nprobe)
+        build_s = time.perf_counter() - start
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            _, found[i] = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - start)
+
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        report.append(
+            {
+                "index_type": index_type,
+                "recall_at_k": hits / truth.size,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                "build_s": build_s,
+                "bytes": int(faiss.serialize_index(index).nbytes),
+            }
+        )
+    return report
+
+
+def print_index_report(report: List[dict], title: Optional[str] = None):
+    if title:
+        print(title)
+    columns = ("index", "recall@k", "p50 ms", "p99 ms", "build s", "MB")
+    print(f"{columns[0]:<8}" + "".join(f"{column:>10}" for column in columns[1:]))
+    for row in report:
+        recall = row["recall_at_k"]
+        recall = "n/a" if recall is None else f"{recall:.3f}"
+        print(
+            f"{row['index_type']:<8}"
+            f"{recall:>10}"
+            f"{row['p50_ms']:>10.3f}"
+            f"{row['p99_ms']:>10.3f}"
+            f"{row['build_s']:>10.2f}"
+            f"{row['bytes'] / 1e6:>10.2f}"
+        )
+
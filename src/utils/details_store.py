@@ -0,0 +1,70 @@
+import json
+from typing import Iterable, Iterator, Optional, Sequence
+
+from utils.metrics import incr
+
+DETAILS_PATH = "src/data/details.jsonl"
+
+
+def append_details(records: Iterable[dict], path=DETAILS_PATH, mode="a") -> int:
+    """Write detail records to `path`, one JSON object per line.
+
+    Records are flushed as they are written, so a partially completed crawl
+    still leaves a readable file. Returns the number of records written.
+    """
+    count = written = 0
+    with open(path, mode, encoding="utf-8") as file:
+        for record in records:
+            line = json.dumps(record, separators=(",", ":")) + "\n"
+            file.write(line)
+            file.flush()
+            count += 1
+            written += len(line.encode("utf-8"))
+    incr("details.records_written", count)
+    incr("details.bytes_written", written)
+    return count
+
+
+def _project(record: dict, fields: Sequence[str]) -> dict:
+    """Keep only `fields` of `record`; dotted names select nested keys."""
+    projected = {}
+    for field in fields:
+        source, target = record, projected
+        *parents, leaf = field.split(".")
+        for key in parents:
+            source = source.get(key)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if leaf in source:
+                target[leaf] = source[leaf]
+    return projected
+
+
+def iter_details(
+    path=DETAILS_PATH, fields: Optional[Sequence[str]] = None
+) -> Iterator[dict]:
+    """Stream detail records from `path`, optionally projected onto `fields`.
+
+    Legacy files holding a single JSON array are still understood, but are
+    loaded in one go; convert them with `convert_legacy_details`.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        head = file.read(1)
+        while head.isspace():
+            head = file.read(1)
+        file.seek(0)
+
+        if head == "[":
+            records = iter(json.load(file))
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+
+        for record in records:
+            yield _project(record, fields) if fields else record
+
+
+def convert_legacy_details(src="src/data/details.json", dst=DETAILS_PATH) -> int:
+    """Rewrite a JSON-array details file as JSON lines."""
+    return append_details(iter_details(src), dst, mode="w")
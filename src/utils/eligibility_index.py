@@ -0,0 +1,174 @@
+import json
+import os
+import re
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set
+
+from utils.details_store import DETAILS_PATH, iter_details
+
+ELIGIBILITY_INDEX_PATH = "src/data/grants_db/eligibility.json"
+
+FIELDS = ("applicant_types", "agency", "funding_instruments")
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def normalize_label(text: str) -> str:
+    """Normalise a taxonomy label the way `eligibility_extractor` does."""
+    return text.split("(")[0].strip()
+
+
+def _section_dates(section: dict, *keys) -> Optional[str]:
+    for key in keys:
+        value = section.get(key) or ""
+        if _ISO_DATE.match(value):
+            return value[:10]
+    return None
+
+
+def opportunity_attributes(grant: dict) -> dict:
+    """Extract the structured, filterable attributes of a detail record."""
+    attributes = {field: set() for field in FIELDS}
+    open_date = close_date = opp_id = None
+
+    for name in ("synopsis", "forecast"):
+        section = grant.get(name) or {}
+        if not section:
+            continue
+        opp_id = opp_id or section.get("opportunityId")
+        attributes["applicant_types"].update(
+            normalize_label(type.get("description", ""))
+            for type in section.get("applicantTypes", [])
+        )
+        attributes["funding_instruments"].update(
+            instrument.get("description", "")
+            for instrument in section.get("fundingInstruments", [])
+        )
+        agency = section.get("agencyDetails") or {}
+        attributes["agency"].update(
+            code
+            for code in (section.get("agencyCode"), agency.get("topAgencyCode"))
+            if code
+        )
+        open_date = open_date or _section_dates(
+            section, "postingDateStr", "estimatedSynopsisPostDateStr"
+        )
+        close_date = close_date or _section_dates(
+            section, "responseDateStr", "estimatedAppResponseDateStr", "archiveDateStr"
+        )
+
+    return {
+        "id": str(opp_id or grant.get("id", "")),
+        "open": open_date,
+        "close": close_date,
+        **{field: sorted(values - {""}) for field, values in attributes.items()},
+    }
+
+
+class EligibilityIndex:
+    """Inverted index from structured grant attributes to opportunity ids.
+
+    Each `(field, value)` maps to a bitmap (a Python int) over opportunity
+    row numbers, so a query is a handful of integer ORs and ANDs. Open and
+    close dates are kept per row for date-window filtering.
+    """
+
+    def __init__(
+        self, ids: List[str], bitmaps: Dict[str, Dict[str, int]], opens, closes
+    ):
+        self.ids = ids
+        self.bitmaps = bitmaps
+        self.opens = opens
+        self.closes = closes
+
+    @classmethod
+    def from_details(cls, records: Iterable[dict]) -> "EligibilityIndex":
+        ids, opens, closes = [], [], []
+        bitmaps = {field: defaultdict(int) for field in FIELDS}
+        for row, grant in enumerate(records):
+            attributes = opportunity_attributes(grant)
+            ids.append(attributes["id"])
+            opens.append(attributes["open"])
+            closes.append(attributes["close"])
+            for field in FIELDS:
+                for value in attributes[field]:
+                    bitmaps[field][value] |= 1 << row
+        return cls(ids, {f: dict(b) for f, b in bitmaps.items()}, opens, closes)
+
+    @classmethod
+    def load(cls, path=ELIGIBILITY_INDEX_PATH) -> "EligibilityIndex":
+        with open(path) as file:
+            data = json.load(file)
+        bitmaps = {
+            field: {value: int(bits, 16) for value, bits in values.items()}
+            for field, values in data["bitmaps"].items()
+        }
+        return cls(data["ids"], bitmaps, data["opens"], data["closes"])
+
+    def save(self, path=ELIGIBILITY_INDEX_PATH):
+        bitmaps = {
+            field: {value: format(bits, "x") for value, bits in values.items()}
+            for field, values in self.bitmaps.items()
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "ids": self.ids,
+                    "bitmaps": bitmaps,
+                    "opens": self.opens,
+                    "closes": self.closes,
+                },
+                file,
+            )
+
+    def values(self, field: str) -> List[str]:
+        return sorted(self.bitmaps[field])
+
+    def _any_of(self, field: str, values: Iterable[str]) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.bitmaps[field].get(value, 0)
+        return bits
+
+    def query(
+        self,
+        applicant_types: Optional[Iterable[str]] = None,
+        agencies: Optional[Iterable[str]] = None,
+        funding_instruments: Optional[Iterable[str]] = None,
+        open_on: Optional[date] = None,
+    ) -> Set[str]:
+        """Return ids of opportunities matching every given filter.
+
+        Within a filter any listed value matches; filters left as None are
+        ignored. `open_on` keeps opportunities posted on or before that date
+        and not yet closed.
+        """
+        bits = (1 << len(self.ids)) - 1
+        for field, values in (
+            ("applicant_types", applicant_types),
+            ("agency", agencies),
+            ("funding_instruments", funding_instruments),
+        ):
+            if values is not None:
+                bits &= self._any_of(field, values)
+
+        if open_on is not None:
+            day = open_on.isoformat()
+            for row in range(len(self.ids)):
+                if (self.opens[row] or "") > day or (self.closes[row] or "9999") < day:
+                    bits &= ~(1 << row)
+
+        return {self.ids[row] for row in range(len(self.ids)) if bits >> row & 1}
+
+
+def build_eligibility_index(
+    details_path=DETAILS_PATH, path=ELIGIBILITY_INDEX_PATH
+) -> EligibilityIndex:
+    """Build the eligibility index from the details store and save it."""
+    index = EligibilityIndex.from_details(
+        iter_details(details_path, fields=("id", "synopsis", "forecast"))
+    )
+    index.save(path)
+    return index
@@ -0,0 +1,131 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+EMBEDDING_CACHE_PATH = "src/data/embeddings_cache.sqlite"
+
+
+def _key(key: Tuple[str, str]) -> bytes:
+    text, model = key
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """On-disk `(text, model) -> embedding` cache backed by SQLite.
+
+    Embeddings are stored as float32 blobs under a hash of the text and model,
+    so inserts and lookups are O(1) regardless of cache size. The database is
+    opened on first use, writes are committed every `commit_every` inserts (or
+    on `flush`), and WAL mode lets other processes read while one writes. With
+    `max_entries` set, the least recently used entries are evicted on commit.
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: Optional[int] = None,
+        commit_every: int = 256,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self._conn = None
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+                "ON embeddings (last_used)"
+            )
+        return self._conn
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM embeddings WHERE key = ?", (_key(key),)
+            ).fetchone()
+        return row is not None
+
+    def __getitem__(self, key) -> np.ndarray:
+        hashed = _key(key)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (hashed,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            if self.max_entries is not None:
+                self.conn.execute(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    (time.time(), hashed),
+                )
+                self._bump()
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def __setitem__(self, key, embedding):
+        vector = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                (_key(key), vector, time.time()),
+            )
+            self._bump()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _bump(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """Commit pending writes and apply size-based eviction."""
+        with self._lock:
+            if self._conn is None:
+                return
+            if self.max_entries is not None:
+                self._conn.execute(
+                    """
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self.flush()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
+
+from tiktoken.model import encoding_name_for_model
+
+from utils.embeddings_utils import aclose_client, aget_embeddings
+from utils.encoding import get_encoding
+from utils.metrics import incr, metrics
+
+EmbedBatch = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+MAX_BATCH_SIZE = 2048
+MAX_BATCH_TOKENS = 250_000
+
+
+def openai_backend(model: str, **kwargs) -> EmbedBatch:
+    """Return a batch embedder backed by the OpenAI embeddings endpoint."""
+
+    async def embed_batch(texts: List[str]) -> List[List[float]]:
+        return await aget_embeddings(texts, model=model, **kwargs)
+
+    return embed_batch
+
+
+def threaded_backend(embed_documents: Callable[[List[str]], List[List[float]]]):
+    """Return a batch embedder that runs a blocking `embed_documents` in a thread."""
+
+    async def embed_batch(texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(embed_documents, texts)
+
+    return embed_batch
+
+
+class EmbeddingService:
+    """Embed texts in deduplicated, token-aware batches with a shared cache.
+
+    Texts already in `cache` (keyed by `(text, model)`, e.g. an
+    `EmbeddingCache`) are served from it. The remaining unique texts are split
+    into batches bounded by `max_batch_size` inputs and `max_batch_tokens`
+    tokens, and up to `concurrency` batches are embedded at once through
+    `embed_batch`.
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatch,
+        model: str,
+        cache: Optional[MutableMapping] = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        concurrency: int = 4,
+    ):
+        self.embed_batch = embed_batch
+        self.model = model
+        self.cache = {} if cache is None else cache
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        try:
+            self.encoding = get_encoding(encoding_name_for_model(model))
+        except KeyError:
+            self.encoding = get_encoding()
+
+    def batches(self, texts: List[str]) -> Iterator[Tuple[List[str], int]]:
+        """Yield `(batch, token_count)` pairs within the configured limits."""
+        batch, tokens = [], 0
+        for text in texts:
+            n_tokens = len(self.encoding.encode(text, disallowed_special=()))
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or tokens + n_tokens > self.max_batch_tokens
+            ):
+                yield batch, tokens
+                batch, tokens = [], 0
+            batch.append(text)
+            tokens += n_tokens
+        if batch:
+            yield batch, tokens
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Return one embedding per input text, in input order."""
+        results, missing = {}, []
+        for text in dict.fromkeys(texts):
+            cached = self.cache.get((text, self.model))
+            if cached is None:
+                missing.append(text)
+            else:
+                results[text] = cached
+        incr("embed.cache_hits", len(results))
+        incr("embed.cache_misses", len(missing))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch, n_tokens):
+            async with semaphore:
+                start = time.perf_counter()
+                embeddings = await self.embed_batch(batch)
+                metrics.observe("embed.batch", time.perf_counter() - start)
+            incr("embed.batches")
+            incr("embed.tokens", n_tokens)
+            for text, embedding in zip(batch, embeddings):
+                results[text] = embedding
+                self.cache[(text, self.model)] = embedding
+
+        await asyncio.gather(
+            *(run(batch, n_tokens) for batch, n_tokens in self.batches(missing))
+        )
+        if missing and hasattr(self.cache, "flush"):
+            self.cache.flush()
+        return [results[text] for text in texts]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        async def run():
+            try:
+                return await self.aembed(texts)
+            finally:
+                await aclose_client()
+
+        return asyncio.run(run())
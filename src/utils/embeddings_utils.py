@@ -1,17 +1,43 @@
-import textwrap as tr
-from typing import List, Optional
-
-import matplotlib.pyplot as plt
-import plotly.express as px
-from scipy import spatial
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
-from sklearn.metrics import average_precision_score, precision_recall_curve
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+import asyncio
+import weakref
+from typing import List
 
-import openai
 import numpy as np
-import pandas as pd
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+
+# Plotting, PCA/t-SNE and evaluation helpers live in utils.embedding_plots, which
+# pulls in matplotlib, plotly, scikit-learn and pandas. They stay importable
+# from here but are only loaded on first access (see __getattr__), so processes
+# that only embed and search load NumPy alone. openai is imported on first use.
+PLOTTING_HELPERS = (
+    "plot_multiclass_precision_recall",
+    "pca_components_from_embeddings",
+    "tsne_components_from_embeddings",
+    "chart_from_components",
+    "chart_from_components_3D",
+)
+
+# AsyncOpenAI pools connections on the event loop that opened them, so each
+# loop (e.g. every asyncio.run) gets a client of its own.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _aclient() -> "openai.AsyncOpenAI":
+    """Return the async OpenAI client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import openai
+
+        client = _async_clients[loop] = openai.AsyncOpenAI()
+    return client
+
+
+async def aclose_client():
+    """Close the running event loop's OpenAI client, if it has one."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
 
 
 @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
@@ -20,6 +46,8 @@ def get_embedding(text: str, model="text-similarity-davinci-001", **kwargs) -> L
     # replace newlines, which can negatively affect performance.
     text = text.replace("\n", " ")
 
+    import openai
+
     response = openai.embeddings.create(input=[text], model=model, **kwargs)
 
     return response.data[0].embedding
@@ -33,9 +61,9 @@ async def aget_embedding(
     # replace newlines, which can negatively affect performance.
     text = text.replace("\n", " ")
 
-    return (await openai.embeddings.create(input=[text], model=model, **kwargs))["data"][0][
-        "embedding"
-    ]
+    response = await _aclient().embeddings.create(input=[text], model=model, **kwargs)
+
+    return response.data[0].embedding
 
 
 @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
@@ -47,6 +75,8 @@ def get_embeddings(
     # replace newlines, which can negatively affect performance.
     list_of_text = [text.replace("\n", " ") for text in list_of_text]
 
+    import openai
+
     data = openai.embeddings.create(input=list_of_text, model=model, **kwargs).data
     return [d.embedding for d in data]
 
@@ -60,7 +90,9 @@ async def aget_embeddings(
     # replace newlines, which can negatively affect performance.
     list_of_text = [text.replace("\n", " ") for text in list_of_text]
 
-    data = (await openai.embeddings.create(input=list_of_text, model=model, **kwargs)).data
+    data = (
+        await _aclient().embeddings.create(input=list_of_text, model=model, **kwargs)
+    ).data
     return [d.embedding for d in data]
 
 
@@ -68,187 +100,103 @@ def cosine_similarity(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 
-def plot_multiclass_precision_recall(
-    y_score, y_true_untransformed, class_list, classifier_name
-):
-    """
-    Precision-Recall plotting for a multiclass problem. It plots average precision-recall, per class precision recall and reference f1 contours.
+DISTANCE_METRICS = ("cosine", "L1", "L2", "Linf")
 
-    Code slightly modified, but heavily based on https://scikit-learn.org/stable/auto_examples/model_selection/plot_precision_recall.html
-    """
-    n_classes = len(class_list)
-    y_true = pd.concat(
-        [(y_true_untransformed == class_list[i]) for i in range(n_classes)], axis=1
-    ).values
-
-    # For each class
-    precision = dict()
-    recall = dict()
-    average_precision = dict()
-    for i in range(n_classes):
-        precision[i], recall[i], _ = precision_recall_curve(y_true[:, i], y_score[:, i])
-        average_precision[i] = average_precision_score(y_true[:, i], y_score[:, i])
-
-    # A "micro-average": quantifying score on all classes jointly
-    precision_micro, recall_micro, _ = precision_recall_curve(
-        y_true.ravel(), y_score.ravel()
-    )
-    average_precision_micro = average_precision_score(y_true, y_score, average="micro")
-    print(
-        str(classifier_name)
-        + " - Average precision score over all classes: {0:0.2f}".format(
-            average_precision_micro
-        )
-    )
 
-    # setup plot details
-    plt.figure(figsize=(9, 10))
-    f_scores = np.linspace(0.2, 0.8, num=4)
-    lines = []
-    labels = []
-    for f_score in f_scores:
-        x = np.linspace(0.01, 1)
-        y = f_score * x / (2 * x - f_score)
-        (l,) = plt.plot(x[y >= 0], y[y >= 0], color="gray", alpha=0.2)
-        plt.annotate("f1={0:0.1f}".format(f_score), xy=(0.9, y[45] + 0.02))
-
-    lines.append(l)
-    labels.append("iso-f1 curves")
-    (l,) = plt.plot(recall_micro, precision_micro, color="gold", lw=2)
-    lines.append(l)
-    labels.append(
-        "average Precision-recall (auprc = {0:0.2f})" "".format(average_precision_micro)
-    )
+def _as_matrix(embeddings) -> np.ndarray:
+    """Return embeddings as a contiguous 2D float32 array."""
+    return np.ascontiguousarray(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
 
-    for i in range(n_classes):
-        (l,) = plt.plot(recall[i], precision[i], lw=2)
-        lines.append(l)
-        labels.append(
-            "Precision-recall for class `{0}` (auprc = {1:0.2f})"
-            "".format(class_list[i], average_precision[i])
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingMatrix:
+    """Embeddings held as one contiguous float32 array for brute-force search.
+
+    Unit-normalised vectors and squared norms are precomputed once, so cosine
+    and L2 distances for a batch of queries reduce to a single matrix product.
+    """
+
+    def __init__(self, embeddings):
+        self.vectors = _as_matrix(embeddings)
+        self.normalized = _normalize(self.vectors)
+        self.squared_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def distances(self, queries, distance_metric="cosine") -> np.ndarray:
+        """Return a (n_queries, n_embeddings) array of distances."""
+        queries = _as_matrix(queries)
+        if distance_metric == "cosine":
+            return 1.0 - _normalize(queries) @ self.normalized.T
+        if distance_metric == "L2":
+            squared = (
+                np.einsum("ij,ij->i", queries, queries)[:, None]
+                + self.squared_norms[None, :]
+                - 2.0 * queries @ self.vectors.T
+            )
+            return np.sqrt(np.maximum(squared, 0.0))
+        if distance_metric == "L1":
+            return np.stack([np.abs(self.vectors - q).sum(axis=1) for q in queries])
+        if distance_metric == "Linf":
+            return np.stack([np.abs(self.vectors - q).max(axis=1) for q in queries])
+        raise ValueError(
+            f"Unknown distance metric {distance_metric!r}, "
+            f"expected one of {DISTANCE_METRICS}"
         )
 
-    fig = plt.gcf()
-    fig.subplots_adjust(bottom=0.25)
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel("Recall")
-    plt.ylabel("Precision")
-    plt.title(f"{classifier_name}: Precision-Recall curve for each class")
-    plt.legend(lines, labels)
+    def search(self, queries, k=10, distance_metric="cosine"):
+        """Return (indices, distances) of the k nearest embeddings per query."""
+        distances = self.distances(queries, distance_metric)
+        indices = indices_of_nearest_neighbors_from_distances(distances, k)
+        return indices, np.take_along_axis(distances, indices, axis=-1)
 
 
 def distances_from_embeddings(
     query_embedding: List[float],
     embeddings: List[List[float]],
     distance_metric="cosine",
-) -> List[List]:
-    """Return the distances between a query embedding and a list of embeddings."""
-    distance_metrics = {
-        "cosine": spatial.distance.cosine,
-        "L1": spatial.distance.cityblock,
-        "L2": spatial.distance.euclidean,
-        "Linf": spatial.distance.chebyshev,
-    }
-    distances = [
-        distance_metrics[distance_metric](query_embedding, embedding)
-        for embedding in embeddings
-    ]
-    return distances
-
-
-def indices_of_nearest_neighbors_from_distances(distances) -> np.ndarray:
-    """Return a list of indices of nearest neighbors from a list of distances."""
-    return np.argsort(distances)
-
-
-def pca_components_from_embeddings(
-    embeddings: List[List[float]], n_components=2
 ) -> np.ndarray:
-    """Return the PCA components of a list of embeddings."""
-    pca = PCA(n_components=n_components)
-    array_of_embeddings = np.array(embeddings)
-    return pca.fit_transform(array_of_embeddings)
-
+    """Return the distances between a query embedding and a list of embeddings.
 
-def tsne_components_from_embeddings(
-    embeddings: List[List[float]], n_components=2, **kwargs
-) -> np.ndarray:
-    """Returns t-SNE components of a list of embeddings."""
-    # use better defaults if not specified
-    if "init" not in kwargs.keys():
-        kwargs["init"] = "pca"
-    if "learning_rate" not in kwargs.keys():
-        kwargs["learning_rate"] = "auto"
-    tsne = TSNE(n_components=n_components, **kwargs)
-    array_of_embeddings = np.array(embeddings)
-    return tsne.fit_transform(array_of_embeddings)
-
-
-def chart_from_components(
-    components: np.ndarray,
-    labels: Optional[List[str]] = None,
-    strings: Optional[List[str]] = None,
-    x_title="Component 0",
-    y_title="Component 1",
-    mark_size=5,
-    **kwargs,
-):
-    """Return an interactive 2D chart of embedding components."""
-    empty_list = ["" for _ in components]
-    data = pd.DataFrame(
-        {
-            x_title: components[:, 0],
-            y_title: components[:, 1],
-            "label": labels if labels else empty_list,
-            "string": ["<br>".join(tr.wrap(string, width=30)) for string in strings]
-            if strings
-            else empty_list,
-        }
-    )
-    chart = px.scatter(
-        data,
-        x=x_title,
-        y=y_title,
-        color="label" if labels else None,
-        symbol="label" if labels else None,
-        hover_data=["string"] if strings else None,
-        **kwargs,
-    ).update_traces(marker=dict(size=mark_size))
-    return chart
-
-
-def chart_from_components_3D(
-    components: np.ndarray,
-    labels: Optional[List[str]] = None,
-    strings: Optional[List[str]] = None,
-    x_title: str = "Component 0",
-    y_title: str = "Component 1",
-    z_title: str = "Compontent 2",
-    mark_size: int = 5,
-    **kwargs,
-):
-    """Return an interactive 3D chart of embedding components."""
-    empty_list = ["" for _ in components]
-    data = pd.DataFrame(
-        {
-            x_title: components[:, 0],
-            y_title: components[:, 1],
-            z_title: components[:, 2],
-            "label": labels if labels else empty_list,
-            "string": ["<br>".join(tr.wrap(string, width=30)) for string in strings]
-            if strings
-            else empty_list,
-        }
+    A 2D batch of queries returns one row of distances per query.
+    """
+    matrix = (
+        embeddings
+        if isinstance(embeddings, EmbeddingMatrix)
+        else EmbeddingMatrix(embeddings)
     )
-    chart = px.scatter_3d(
-        data,
-        x=x_title,
-        y=y_title,
-        z=z_title,
-        color="label" if labels else None,
-        symbol="label" if labels else None,
-        hover_data=["string"] if strings else None,
-        **kwargs,
-    ).update_traces(marker=dict(size=mark_size))
-    return chart
\ No newline at end of file
+    distances = matrix.distances(query_embedding, distance_metric)
+    return distances[0] if np.ndim(query_embedding) == 1 else distances
+
+
+def indices_of_nearest_neighbors_from_distances(distances, k=None) -> np.ndarray:
+    """Return indices of nearest neighbors from distances, closest first.
+
+    With `k`, only the k nearest are selected (via argpartition) and sorted.
+    Works along the last axis, so a 2D array of per-query distances is fine.
+    """
+    distances = np.asarray(distances)
+    n = distances.shape[-1]
+    if k is None or k >= n:
+        return np.argsort(distances, axis=-1)
+    top = np.argpartition(distances, k - 1, axis=-1)[..., :k]
+    order = np.argsort(np.take_along_axis(distances, top, axis=-1), axis=-1)
+    return np.take_along_axis(top, order, axis=-1)
+
+
+def __getattr__(name):
+    if name in PLOTTING_HELPERS:
+        from utils import embedding_plots
+
+        return getattr(embedding_plots, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(PLOTTING_HELPERS))
@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_MODE_ENV = "GRANTS_HTTP_MODE"
+HTTP_ARCHIVE_ENV = "GRANTS_HTTP_ARCHIVE"
+REPLAY_URL_ENV = "GRANTS_HTTP_REPLAY_URL"
+HTTP_ARCHIVE_PATH = "src/data/http_archive.sqlite"
+HTTP_MODES = ("live", "record", "replay")
+
+ORIGINAL_URL_HEADER = "X-Replay-Url"
+MISS_HEADER = "X-Replay-Miss"
+
+
+class ReplayMiss(requests.ConnectionError):
+    """The replay archive has no response for a request."""
+
+
+def http_mode() -> str:
+    """Return the transport mode from `$GRANTS_HTTP_MODE` (default: live)."""
+    mode = os.environ.get(HTTP_MODE_ENV, "live").lower()
+    if mode not in HTTP_MODES:
+        raise ValueError(f"{HTTP_MODE_ENV} must be one of {HTTP_MODES}, not {mode!r}")
+    return mode
+
+
+def canonical_body(body, content_type="") -> bytes:
+    """Normalise a request body so equivalent payloads hash the same."""
+    if not body:
+        return b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        if "json" in content_type:
+            return json.dumps(json.loads(body), sort_keys=True).encode("utf-8")
+        if "x-www-form-urlencoded" in content_type:
+            return json.dumps(sorted(parse_qsl(body.decode("utf-8")))).encode("utf-8")
+    except ValueError:
+        pass
+    return body
+
+
+def request_key(method, url, body=None, content_type="") -> bytes:
+    digest = hashlib.sha256(f"{method.upper()} {url}\0".encode("utf-8"))
+    digest.update(canonical_body(body, content_type))
+    return digest.digest()
+
+
+class HttpArchive:
+    """Recorded HTTP responses keyed by method, URL and canonical payload.
+
+    Request and response bodies are zlib-compressed in a single SQLite file;
+    a re-recorded request replaces the previous response.
+    """
+
+    def __init__(self, path=HTTP_ARCHIVE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key BLOB PRIMARY KEY,
+                    method TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    request BLOB,
+                    status INTEGER NOT NULL,
+                    content_type TEXT,
+                    body BLOB NOT NULL,
+                    recorded_at REAL NOT NULL
+                )
+                """
+            )
+        return self._conn
+
+    def put(self, method, url, request_body, content_type, response):
+        key = request_key(method, url, request_body, content_type)
+        if isinstance(request_body, str):
+            request_body = request_body.encode("utf-8")
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    method.upper(),
+                    url,
+                    zlib.compress(request_body or b""),
+                    response.status_code,
+                    response.headers.get("Content-Type"),
+                    zlib.compress(response.content),
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+
+    def get(self, key: bytes) -> Optional[Tuple[int, str, bytes]]:
+        """Return `(status, content type, body)` for a request key, if recorded."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, content_type, body FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], zlib.decompress(row[2])
+
+    def requests(self, url=None) -> Iterator[Tuple[str, str, bytes]]:
+        """Yield `(method, url, request body)` of recorded requests."""
+        query, args = "SELECT method, url, request FROM responses", ()
+        if url is not None:
+            query, args = query + " WHERE url = ?", (url,)
+        with self._lock:
+            rows = self.conn.execute(query, args).fetchall()
+        for method, recorded_url, body in rows:
+            yield method, recorded_url, zlib.decompress(body)
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests live and saves every response to an `HttpArchive`."""
+
+    def __init__(self, archive: HttpArchive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        self.archive.put(
+            request.method,
+            request.url,
+            request.body,
+            request.headers.get("Content-Type", ""),
+            response,
+        )
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Sends every request to a replay server instead of the original host.
+
+    The original URL travels in a header; a request the archive does not
+    know raises `ReplayMiss` instead of falling through to the network.
+    """
+
+    def __init__(self, server_url, **kwargs):
+        super().__init__(**kwargs)
+        self.server_url = server_url.rstrip("/")
+
+    def send(self, request, **kwargs):
+        original = request.url
+        request.headers[ORIGINAL_URL_HEADER] = original
+        request.url = self.server_url + "/replay"
+        response = super().send(request, **kwargs)
+        response.url = original
+        if response.headers.get(MISS_HEADER):
+            raise ReplayMiss(f"No recorded response for {request.method} {original}")
+        return response
+
+
+class ReplayServer:
+    """Local stand-in for grants.gov that serves responses from an archive.
+
+    Each response is delayed by `latency` seconds plus up to `jitter` more.
+    A fraction `error_rate` of requests gets a 503 and `drop_rate` has its
+    connection closed without a response, to exercise retries. `port=0`
+    picks a free port; see `url`.
+    """
+
+    def __init__(
+        self,
+        archive_path=HTTP_ARCHIVE_PATH,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        drop_rate=0.0,
+        seed=None,
+    ):
+        self.archive = HttpArchive(archive_path)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "misses": 0, "errors": 0, "drops": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _handler(self):
+        replay = self
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status, content_type, body, extra=()):
+                self.send_response(status)
+                if content_type:
+                    self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in extra:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _replay(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                url = self.headers.get(ORIGINAL_URL_HEADER, "")
+                content_type = self.headers.get("Content-Type", "")
+                replay._count("requests")
+
+                with replay._lock:
+                    delay = replay.latency + replay.random.uniform(0, replay.jitter)
+                    roll = replay.random.random()
+                time.sleep(delay)
+                if roll < replay.drop_rate:
+                    replay._count("drops")
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if roll < replay.drop_rate + replay.error_rate:
+                    replay._count("errors")
+                    return self._send(503, "text/plain", b"injected error")
+
+                recorded = replay.archive.get(
+                    request_key(self.command, url, body, content_type)
+                )
+                if recorded is None:
+                    replay._count("misses")
+                    return self._send(
+                        404, "text/plain", b"not recorded", [(MISS_HEADER, "1")]
+                    )
+                self._send(*recorded)
+
+            do_GET = do_POST = _replay
+
+            def log_message(self, format, *args):
+                pass
+
+        return ReplayHandler
+
+    def start(self) -> "ReplayServer":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.archive.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+_archives = {}
+_default_server = None
+_default_lock = threading.Lock()
+
+
+def get_archive(path=None) -> HttpArchive:
+    """Return the shared archive at `path` (default: `$GRANTS_HTTP_ARCHIVE`)."""
+    path = path or os.environ.get(HTTP_ARCHIVE_ENV, HTTP_ARCHIVE_PATH)
+    with _default_lock:
+        if path not in _archives:
+            _archives[path] = HttpArchive(path)
+        return _archives[path]
+
+
+def replay_url() -> str:
+    """Return `$GRANTS_HTTP_REPLAY_URL`, else start an in-process replay server."""
+    global _default_server
+    url = os.environ.get(REPLAY_URL_ENV)
+    if url:
+        return url
+    with _default_lock:
+        if _default_server is None:
+            path = os.environ.get(HTTP_ARCHIVE_ENV, HTTP_ARCHIVE_PATH)
+            _default_server = ReplayServer(path).start()
+    return _default_server.url
+
+
+def transport_adapter(**kwargs) -> HTTPAdapter:
+    """Return the session adapter for the configured `$GRANTS_HTTP_MODE`.
+
+    `live` talks to the network, `record` does too but archives every
+    response in `$GRANTS_HTTP_ARCHIVE`, and `replay` serves archived
+    responses through a replay server. Keyword arguments go to `HTTPAdapter`.
+    """
+    mode = http_mode()
+    if mode == "record":
+        return RecordingAdapter(get_archive(), **kwargs)
+    if mode == "replay":
+        return ReplayAdapter(replay_url(), **kwargs)
+    return HTTPAdapter(**kwargs)
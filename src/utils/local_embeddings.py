@@ -0,0 +1,111 @@
+import atexit
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+
+class LocalEmbeddings(Embeddings):
+    """Sentence-transformers encoder tuned for CPU-only hosts.
+
+    Inputs are sorted by length before batching so each batch pads to similar
+    lengths, and large inputs are spread over `processes` worker processes
+    (all cores by default). `backend="onnx"` runs the ONNX export of the model
+    and `quantize=True` applies int8 dynamic quantization to the torch model.
+    Embeddings come back as float32 NumPy arrays. The worker pool is stopped
+    by `close()`, on leaving a `with` block, or at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        batch_size: int = 64,
+        processes: Optional[int] = None,
+        backend: str = "torch",
+        quantize: bool = False,
+        normalize: bool = False,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.processes = processes or os.cpu_count() or 1
+        self.backend = backend
+        self.quantize = quantize
+        self.normalize = normalize
+        self._model = None
+        self._pool = None
+
+    @property
+    def cache_key(self) -> str:
+        """Model identifier that changes whenever the vectors would change."""
+        suffix = [self.backend] if self.backend != "torch" else []
+        suffix += ["int8"] if self.quantize else []
+        suffix += ["normalized"] if self.normalize else []
+        return ":".join([self.model_name] + suffix)
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            kwargs = {"backend": self.backend} if self.backend != "torch" else {}
+            model = SentenceTransformer(self.model_name, device="cpu", **kwargs)
+            if self.quantize and self.backend == "torch":
+                import torch
+
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            self._model = model
+        return self._model
+
+    def _encode_sorted(self, texts: List[str]) -> np.ndarray:
+        if self.processes > 1 and len(texts) >= self.batch_size * self.processes:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(
+                    ["cpu"] * self.processes
+                )
+                atexit.register(self.close)
+            return self.model.encode_multi_process(
+                texts,
+                self._pool,
+                batch_size=self.batch_size,
+                chunk_size=self.batch_size * 4,
+                normalize_embeddings=self.normalize,
+            )
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize,
+        )
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Return a (len(texts), dim) float32 array, in input order."""
+        if not texts:
+            dim = self.model.get_sentence_embedding_dimension()
+            return np.empty((0, dim), dtype=np.float32)
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        encoded = self._encode_sorted([texts[i] for i in order])
+        embeddings = np.empty_like(encoded, dtype=np.float32)
+        embeddings[order] = encoded
+        return embeddings
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self.encode(texts)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+    def close(self):
+        """Stop the worker processes, if any were started."""
+        if self._pool is not None:
+            atexit.unregister(self.close)
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List
+
+
+def content_hash(record: dict) -> str:
+    """Return a stable hash of a JSON-serialisable record."""
+    payload = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """Persistent record of every opportunity seen by the crawler.
+
+    Rows are keyed by opportunity id and hold the hash of the list-level hit
+    (from `grant_list`) together with the last fetched detail, so unchanged
+    opportunities can be carried forward without another detail request.
+    """
+
+    def __init__(self, path="src/data/manifest.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS opportunities (
+                id TEXT PRIMARY KEY,
+                list_hash TEXT NOT NULL,
+                detail TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stale(self, hits: Iterable[dict]) -> List[dict]:
+        """Return the hits that are new or whose list-level fields changed."""
+        known = dict(
+            self.conn.execute(
+                "SELECT id, list_hash FROM opportunities WHERE detail IS NOT NULL"
+            )
+        )
+        return [hit for hit in hits if known.get(str(hit["id"])) != content_hash(hit)]
+
+    def update(self, hit: dict, detail: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO opportunities VALUES (?, ?, ?, ?)",
+            (
+                str(hit["id"]),
+                content_hash(hit),
+                json.dumps(detail),
+                datetime.now(timezone.utc).isoformat(),
+            ),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def prune(self, keep_ids: Iterable) -> int:
+        """Drop opportunities that no longer appear in the listing."""
+        keep = {str(id) for id in keep_ids}
+        gone = [
+            id
+            for (id,) in self.conn.execute("SELECT id FROM opportunities")
+            if id not in keep
+        ]
+        self.conn.executemany(
+            "DELETE FROM opportunities WHERE id = ?", [(id,) for id in gone]
+        )
+        self.conn.commit()
+        return len(gone)
+
+    def details(self) -> Iterator[dict]:
+        for (detail,) in self.conn.execute(
+            "SELECT detail FROM opportunities WHERE detail IS NOT NULL ORDER BY id"
+        ):
+            yield json.loads(detail)
@@ -0,0 +1,155 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+METRICS_PATH_ENV = "GRANTS_METRICS_PATH"
+PROFILE_ENV = "GRANTS_PROFILE"
+PROFILE_DIR_ENV = "GRANTS_PROFILE_DIR"
+
+MAX_SAMPLES = 10_000
+
+
+class Metrics:
+    """Thread-safe registry of timers and counters.
+
+    Timers keep a count, total and a bounded sample of durations so that
+    percentiles can be reported; counters are plain running sums (requests,
+    bytes, tokens, cache hits, ...).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            timer = self.timers.setdefault(
+                name, {"count": 0, "total_s": 0.0, "max_s": 0.0, "samples": []}
+            )
+            timer["count"] += 1
+            timer["total_s"] += seconds
+            timer["max_s"] = max(timer["max_s"], seconds)
+            if len(timer["samples"]) < MAX_SAMPLES:
+                timer["samples"].append(seconds)
+
+    def incr(self, name: str, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timer(self, name: str):
+        """Decorator form of `timed`."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timed(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timers = {}
+            for name, timer in self.timers.items():
+                samples = np.array(timer["samples"])
+                timers[name] = {
+                    "count": timer["count"],
+                    "total_s": timer["total_s"],
+                    "mean_ms": timer["total_s"] / timer["count"] * 1000,
+                    "p50_ms": float(np.percentile(samples, 50) * 1000),
+                    "p99_ms": float(np.percentile(samples, 99) * 1000),
+                    "max_ms": timer["max_s"] * 1000,
+                }
+            counters = dict(self.counters)
+        hits = counters.get("embed.cache_hits", 0)
+        misses = counters.get("embed.cache_misses", 0)
+        if hits + misses:
+            counters["embed.cache_hit_rate"] = hits / (hits + misses)
+        return {
+            "started": self.started,
+            "elapsed_s": time.time() - self.started,
+            "timers": timers,
+            "counters": counters,
+        }
+
+    def emit(self, path: Optional[str] = None, **labels):
+        """Write the current snapshot as one JSON line.
+
+        The line goes to `path`, else to `$GRANTS_METRICS_PATH`, else stderr.
+        """
+        record = {**labels, **self.snapshot()}
+        line = json.dumps(record, sort_keys=True)
+        path = path or os.environ.get(METRICS_PATH_ENV)
+        if path:
+            with open(path, "a") as file:
+                file.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+        return record
+
+
+metrics = Metrics()
+timed = metrics.timed
+timer = metrics.timer
+incr = metrics.incr
+
+
+@contextmanager
+def profiled(name: str):
+    """Profile the block when `$GRANTS_PROFILE` is set.
+
+    `GRANTS_PROFILE=cprofile` dumps cProfile stats and `GRANTS_PROFILE=sampling`
+    writes a pyinstrument HTML report (if pyinstrument is installed) to
+    `$GRANTS_PROFILE_DIR` (default: the working directory) as `{name}.*`.
+    """
+    mode = os.environ.get(PROFILE_ENV, "").lower()
+    out_dir = os.environ.get(PROFILE_DIR_ENV, ".")
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(out_dir, f"{name}.prof"))
+    elif mode == "sampling":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed; sampling profiler disabled")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(out_dir, f"{name}.html"), "w") as file:
+                file.write(profiler.output_html())
+    else:
+        yield
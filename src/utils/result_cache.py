@@ -0,0 +1,190 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+RESULT_CACHE_PATH = "src/data/results_cache.sqlite"
+
+Matches = List[Tuple[str, float]]
+
+
+def _key(text: str, model: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+def params_key(**params) -> str:
+    """Canonical string for the search parameters that shape a result."""
+    normalized = {
+        name: sorted(map(str, value)) if isinstance(value, (set, frozenset)) else value
+        for name, value in params.items()
+    }
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """Cache of profile matches keyed by profile text, model and index build.
+
+    Each `(text, model)` entry holds the query embedding plus its top-k
+    results per `(index version, search parameters)`. `index_version` should
+    identify the content of the build (e.g. `build_version`), so a result is
+    never served for a different index. Storing a result supersedes that
+    entry's results for the same parameters from other builds; results for
+    other parameters, and the embeddings, are kept. Recently used entries are
+    held in memory, so a repeat query is a dictionary lookup; all entries are
+    also persisted to SQLite (unless `path` is None) and bounded to
+    `max_entries`, evicting the least recently used; recency updates are
+    written on `flush`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = RESULT_CACHE_PATH,
+        max_entries: int = 10_000,
+        memory_entries: int = 1024,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._touched = {}
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self.path is not None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS queries (
+                    key BLOB PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS queries_last_used
+                    ON queries (last_used);
+                CREATE TABLE IF NOT EXISTS results (
+                    key BLOB NOT NULL,
+                    index_version TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    matches TEXT NOT NULL,
+                    PRIMARY KEY (key, index_version, params)
+                );
+                """
+            )
+        return self._conn
+
+    def _remember(self, key: bytes, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: bytes):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            "SELECT vector FROM queries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        results = {
+            (version, params): [tuple(match) for match in json.loads(matches)]
+            for version, params, matches in self.conn.execute(
+                "SELECT index_version, params, matches FROM results WHERE key = ?",
+                (key,),
+            )
+        }
+        entry = (np.frombuffer(row[0], dtype=np.float32), results)
+        self._remember(key, entry)
+        return entry
+
+    def lookup(
+        self, text: str, model: str, index_version: str, params: str = ""
+    ) -> Tuple[Optional[np.ndarray], Optional[Matches]]:
+        """Return `(query embedding, matches)`; either may be None if unknown."""
+        key = _key(text, model)
+        with self._lock:
+            entry = self._load(key)
+            if entry is None:
+                return None, None
+            if self.path is not None:
+                self._touched[key] = time.time()
+            vector, results = entry
+            return vector, results.get((index_version, params))
+
+    def store(
+        self,
+        text: str,
+        model: str,
+        index_version: str,
+        params: str,
+        vector,
+        matches: Matches,
+    ):
+        key = _key(text, model)
+        vector = np.asarray(vector, dtype=np.float32)
+        matches = [(str(opp_id), float(distance)) for opp_id, distance in matches]
+        with self._lock:
+            results = (self._load(key) or (vector, {}))[1]
+            for stale in [result for result in results if result[1] == params]:
+                del results[stale]
+            results[(index_version, params)] = matches
+            self._remember(key, (vector, results))
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), time.time()),
+                )
+                self.conn.execute(
+                    "DELETE FROM results WHERE key = ? AND params = ?", (key, params)
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (key, index_version, params, json.dumps(matches)),
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self.conn is None:
+                return len(self._memory)
+            return self.conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def flush(self):
+        """Commit pending writes and evict entries beyond `max_entries`."""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.executemany(
+                "UPDATE queries SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+            evicted = self._conn.execute(
+                "SELECT key FROM queries ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                (self.max_entries,),
+            ).fetchall()
+            for (key,) in evicted:
+                self._memory.pop(key, None)
+            self._conn.executemany("DELETE FROM queries WHERE key = ?", evicted)
+            self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self.flush()
+                self._conn.close()
+                self._conn = None
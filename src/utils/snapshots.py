@@ -0,0 +1,255 @@
+import csv
+import gzip
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.manifest import content_hash
+
+SNAPSHOT_DIR = "src/data/synopsis"
+DELTA_DIR_NAME = "deltas"
+ID_COLUMN = "opportunity_id"
+HASH_LENGTH = 16
+CHECKPOINT_DAYS = 30
+
+
+def _open(path, mode="rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _delta_dir(data_dir):
+    return os.path.join(data_dir, DELTA_DIR_NAME)
+
+
+def _delta_path(data_dir, day):
+    return os.path.join(_delta_dir(data_dir), f"{day}.delta.jsonl.gz")
+
+
+def _hashes_path(data_dir, day):
+    return os.path.join(_delta_dir(data_dir), f"{day}.hashes.json")
+
+
+def snapshot_path(day, data_dir=SNAPSHOT_DIR) -> Optional[str]:
+    """Return the full CSV snapshot for `day`, if one is on disk."""
+    for name in (f"{day}.csv", f"{day}.csv.gz"):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def snapshot_dates(data_dir=SNAPSHOT_DIR) -> List[str]:
+    """Return every date with a full snapshot or a stored delta, oldest first."""
+    days = set()
+    for name in os.listdir(data_dir):
+        if name.endswith((".csv", ".csv.gz")) and "-combined" not in name:
+            days.add(name.split(".")[0])
+    if os.path.isdir(_delta_dir(data_dir)):
+        days.update(
+            name.split(".")[0]
+            for name in os.listdir(_delta_dir(data_dir))
+            if name.endswith(".delta.jsonl.gz")
+        )
+    return sorted(days)
+
+
+def row_hash(row: dict) -> str:
+    return content_hash(row)[:HASH_LENGTH]
+
+
+def _read_rows(path) -> Tuple[List[str], Dict[str, dict]]:
+    with _open(path) as file:
+        reader = csv.DictReader(file)
+        rows = {row[ID_COLUMN]: row for row in reader}
+        return list(reader.fieldnames or []), rows
+
+
+def _delta_header(path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return json.loads(file.readline())
+
+
+def read_snapshot(day, data_dir=SNAPSHOT_DIR) -> Tuple[List[str], Dict[str, dict]]:
+    """Return `(columns, rows by opportunity id)` for `day`.
+
+    Compacted days are rebuilt from the nearest later full snapshot by
+    applying the reverse deltas along the chain, newest first.
+    """
+    chain = []
+    path = snapshot_path(day, data_dir)
+    while path is None:
+        delta = _delta_path(data_dir, day)
+        if not os.path.exists(delta):
+            raise FileNotFoundError(f"No snapshot or delta for {day} in {data_dir}")
+        chain.append(delta)
+        day = _delta_header(delta)["base"]
+        path = snapshot_path(day, data_dir)
+
+    columns, rows = _read_rows(path)
+    for delta in reversed(chain):
+        with gzip.open(delta, "rt", encoding="utf-8") as file:
+            columns = json.loads(file.readline())["columns"]
+            for line in file:
+                record = json.loads(line)
+                if record["op"] == "put":
+                    rows[record["row"][ID_COLUMN]] = record["row"]
+                else:
+                    rows.pop(record["id"], None)
+    return columns, rows
+
+
+def _source_stamp(day, data_dir) -> Optional[List[float]]:
+    path = snapshot_path(day, data_dir)
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def snapshot_hashes(day, data_dir=SNAPSHOT_DIR) -> Dict[str, str]:
+    """Return `{opportunity_id: content hash}` for `day`, caching the result.
+
+    The cache is recomputed when the day's full snapshot has been rewritten
+    since it was taken.
+    """
+    path = _hashes_path(data_dir, day)
+    stamp = _source_stamp(day, data_dir)
+    if os.path.exists(path):
+        with open(path) as file:
+            cached = json.load(file)
+        if stamp is None or cached["source"] == stamp:
+            return cached["hashes"]
+
+    _, rows = read_snapshot(day, data_dir)
+    hashes = {opp_id: row_hash(row) for opp_id, row in rows.items()}
+    os.makedirs(_delta_dir(data_dir), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({"source": stamp, "hashes": hashes}, file, separators=(",", ":"))
+    return hashes
+
+
+@dataclass
+class SnapshotDiff:
+    """Opportunities added, removed and modified between two snapshots."""
+
+    old: str
+    new: str
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> List[str]:
+        """Opportunities worth matching again: new ones plus modified ones."""
+        return self.added + self.modified
+
+    def summary(self) -> str:
+        return (
+            f"{self.old} -> {self.new}: {len(self.added)} added, "
+            f"{len(self.removed)} removed, {len(self.modified)} modified"
+        )
+
+
+def diff_snapshots(old, new, data_dir=SNAPSHOT_DIR) -> SnapshotDiff:
+    """Compare two dates by opportunity id and row content hash."""
+    before = snapshot_hashes(old, data_dir)
+    after = snapshot_hashes(new, data_dir)
+    return SnapshotDiff(
+        old,
+        new,
+        added=sorted(set(after) - set(before)),
+        removed=sorted(set(before) - set(after)),
+        modified=sorted(
+            opp_id
+            for opp_id in set(before) & set(after)
+            if before[opp_id] != after[opp_id]
+        ),
+    )
+
+
+def write_delta(day, base, data_dir=SNAPSHOT_DIR) -> str:
+    """Store `day` as a reverse delta against the later snapshot `base`.
+
+    Only rows that differ from `base` are written (`put`), plus the ids that
+    `base` added (`drop`), gzip-compressed.
+    """
+    columns, rows = read_snapshot(day, data_dir)
+    _, base_rows = read_snapshot(base, data_dir)
+    path = _delta_path(data_dir, day)
+    os.makedirs(_delta_dir(data_dir), exist_ok=True)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as file:
+        file.write(json.dumps({"date": day, "base": base, "columns": columns}) + "\n")
+        for opp_id, row in rows.items():
+            if base_rows.get(opp_id) != row:
+                file.write(json.dumps({"op": "put", "row": row}) + "\n")
+        for opp_id in base_rows.keys() - rows.keys():
+            file.write(json.dumps({"op": "drop", "id": opp_id}) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+def compact_snapshots(
+    data_dir=SNAPSHOT_DIR, keep=1, checkpoint: Optional[int] = CHECKPOINT_DAYS
+) -> List[str]:
+    """Replace all but the newest `keep` full snapshots with reverse deltas.
+
+    Every `checkpoint`-th day stays a full snapshot, so rebuilding any day
+    applies fewer than `checkpoint` deltas; None or 0 compacts every day.
+    Each compacted day is verified to rebuild to the same content hashes
+    before its CSV (and its derived `-combined.csv`) is removed. Returns the
+    days compacted.
+    """
+    days = snapshot_dates(data_dir)
+    full = [day for day in days if snapshot_path(day, data_dir)]
+    candidates = dict(zip(full, full[1 : len(full) - keep + 1]))
+    compacted = []
+    run = 0
+    for day in days:
+        if day not in candidates and snapshot_path(day, data_dir) is None:
+            run += 1
+            continue
+        if day not in candidates or (checkpoint and run + 1 >= checkpoint):
+            run = 0
+            continue
+        run += 1
+        base = candidates[day]
+        expected = snapshot_hashes(day, data_dir)
+        write_delta(day, base, data_dir)
+        path = snapshot_path(day, data_dir)
+        os.rename(path, path + ".bak")
+        try:
+            _, rows = read_snapshot(day, data_dir)
+            rebuilt = {opp_id: row_hash(row) for opp_id, row in rows.items()}
+        except Exception:
+            os.rename(path + ".bak", path)
+            raise
+        if rebuilt != expected:
+            os.rename(path + ".bak", path)
+            raise ValueError(f"Delta for {day} does not rebuild the snapshot")
+        os.remove(path + ".bak")
+        combined = os.path.join(data_dir, f"{day}-combined.csv")
+        if os.path.exists(combined):
+            os.remove(combined)
+        compacted.append(day)
+    return compacted
+
+
+def materialize(day, outfile, data_dir=SNAPSHOT_DIR) -> str:
+    """Write the full snapshot for `day` to `outfile` as CSV."""
+    columns, rows = read_snapshot(day, data_dir)
+    with _open(outfile, "wt") as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows.values())
+    return outfile
+
+
+def iter_changed_rows(diff: SnapshotDiff, data_dir=SNAPSHOT_DIR) -> Iterator[dict]:
+    """Yield the new-side rows of every added or modified opportunity."""
+    _, rows = read_snapshot(diff.new, data_dir)
+    for opp_id in diff.changed:
+        yield rows[opp_id]
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from langchain.vectorstores import FAISS
+
+from utils.chunking import chunk_opportunities
+from utils.compact_index import compact_index_type, export_compact, load_compact
+from utils.metrics import incr, timer
+
+INDEX_DIR = "src/data/grants_db"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+COMPACT_DIR = "compact"
+
+
+def group_by_opportunity(docs) -> Dict[str, list]:
+    """Group chunked documents by the opportunity id stored in their metadata."""
+    groups = defaultdict(list)
+    for doc in docs:
+        groups[str(doc.metadata["source"])].append(doc)
+    return groups
+
+
+def _hash_documents(docs) -> str:
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+        # shared chunks are re-saved when the set of grants sharing them changes
+        digest.update(",".join(chunk_opportunities(doc)).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def embedding_model_name(embedding_function) -> str:
+    service = getattr(embedding_function, "service", None)
+    return getattr(service, "model", None) or type(embedding_function).__name__
+
+
+def current_version(index_dir=INDEX_DIR) -> Optional[str]:
+    """Return the name of the live index build, or None if nothing is built."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def build_version(manifest) -> str:
+    """Content hash of an index build: equal for builds of the same chunks.
+
+    Unlike the `build` counter, it changes whenever the indexed content or the
+    compact index type does, even if the index directory was rebuilt from
+    scratch.
+    """
+    content = {name: value for name, value in manifest.items() if name != "build"}
+    payload = json.dumps(content, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def load_index(
+    index_dir, embedding_function, compact=True
+) -> Tuple[Optional[FAISS], dict]:
+    """Load the live index build and its manifest.
+
+    With `compact`, the build's compact export (see `save_index`) is loaded
+    when there is one: read-only, unpickled and memory-mapped. Callers that
+    modify the index need `compact=False`.
+    """
+    version = current_version(index_dir)
+    if version is None:
+        return None, {"build": 0, "opportunities": {}}
+
+    path = os.path.join(index_dir, version)
+    with open(os.path.join(path, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    compact_path = os.path.join(path, COMPACT_DIR)
+    if compact and compact_index_type(compact_path):
+        return load_compact(compact_path, embedding_function), manifest
+    return FAISS.load_local(path, embedding_function), manifest
+
+
+def save_index(db, manifest, index_dir=INDEX_DIR, index_type=None) -> str:
+    """Write a new index build and atomically point CURRENT at it.
+
+    Readers either see the previous build or the new one, never a partially
+    written directory. With `index_type` (see `INDEX_TYPES`), a compact copy
+    of that type is exported next to the full build for readers to load.
+    Builds older than the previous one are removed.
+    """
+    previous = current_version(index_dir)
+    version = f"v{manifest['build']:06d}"
+    path = os.path.join(index_dir, version)
+    os.makedirs(path, exist_ok=True)
+
+    manifest["index_type"] = index_type
+    db.save_local(path)
+    with open(os.path.join(path, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file)
+    if index_type is not None:
+        export_compact(db, os.path.join(path, COMPACT_DIR), index_type)
+
+    tmp = os.path.join(index_dir, CURRENT_FILE + ".tmp")
+    with open(tmp, "w") as file:
+        file.write(version)
+    os.replace(tmp, os.path.join(index_dir, CURRENT_FILE))
+
+    for name in os.listdir(index_dir):
+        if name.startswith("v") and name not in (version, previous):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    return path
+
+
+@timer("index.update")
+def update_index(
+    docs, embedding_function, index_dir=INDEX_DIR, index_type=None
+) -> FAISS:
+    """Bring the persistent index in line with `docs`, embedding only the delta.
+
+    `docs` is the full current set of chunked grant documents. Opportunities
+    whose chunks are unchanged keep their existing vectors; new or changed
+    ones are (re-)embedded, and opportunities missing from `docs` (closed or
+    archived) are removed. If the index was built with another embedding
+    model, everything is re-embedded. `index_type` selects the compact export written
+    with each build (see `save_index`).
+    """
+    groups = group_by_opportunity(docs)
+    hashes = {opp_id: _hash_documents(chunks) for opp_id, chunks in groups.items()}
+
+    db, manifest = load_index(index_dir, embedding_function, compact=False)
+    model = embedding_model_name(embedding_function)
+    if db is not None and manifest.get("model") != model:
+        print(f"Index was built with {manifest.get('model')}; rebuilding with {model}")
+        db, manifest["opportunities"] = None, {}
+    manifest["model"] = model
+    known = manifest["opportunities"]
+
+    removed = [opp_id for opp_id in known if opp_id not in groups]
+    changed = [
+        opp_id
+        for opp_id in groups
+        if known.get(opp_id, {}).get("hash") != hashes[opp_id]
+    ]
+    if db is not None and not removed and not changed:
+        live = os.path.join(index_dir, current_version(index_dir), COMPACT_DIR)
+        if index_type is None or compact_index_type(live) == index_type:
+            return db
+        manifest["build"] += 1
+        save_index(db, manifest, index_dir, index_type)
+        return db
+
+    stale_ids: List[str] = [
+        doc_id
+        for opp_id in removed + changed
+        if opp_id in known
+        for doc_id in known[opp_id]["ids"]
+    ]
+    if db is not None and stale_ids:
+        db.delete(stale_ids)
+    for opp_id in removed:
+        known.pop(opp_id)
+
+    new_docs, new_ids = [], []
+    for opp_id in changed:
+        ids = [f"{opp_id}:{i}" for i in range(len(groups[opp_id]))]
+        new_docs.extend(groups[opp_id])
+        new_ids.extend(ids)
+        known[opp_id] = {"hash": hashes[opp_id], "ids": ids}
+
+    if new_docs:
+        if db is None:
+            db = FAISS.from_documents(new_docs, embedding_function, ids=new_ids)
+        else:
+            db.add_documents(new_docs, ids=new_ids)
+    incr("index.opportunities_embedded", len(changed))
+    incr("index.opportunities_removed", len(removed))
+    print(
+        f"Index update: {len(changed)} embedded, {len(removed)} removed, "
+        f"{len(groups) - len(changed)} unchanged"
+    )
+
+    if db is None:
+        return db
+    manifest["build"] += 1
+    save_index(db, manifest, index_dir, index_type)
+    return db
@@ -0,0 +1,85 @@
+from utils.chunking import (
+    NEAR_DUPLICATE_DISTANCE,
+    ChunkDeduplicator,
+    chunk_documents,
+    chunk_opportunities,
+    normalize_chunk,
+    simhash,
+    split_text,
+)
+from utils.encoding import WordEncoding
+
+BOILERPLATE = (
+    "Applicant Eligibility Description: Eligible applicants include state and "
+    "local governments, federally recognized tribes, public and private "
+    "institutions of higher education, and nonprofit organizations with "
+    "501(c)(3) status that are located in the United States."
+)
+
+
+def test_word_encoding_round_trips():
+    encoding = WordEncoding()
+    text = "  Grants for rural-broadband, (2024)!\n"
+
+    tokens = encoding.encode(text)
+
+    assert encoding.decode(tokens) == text
+    assert encoding.decode(tokens[:3]) == "  Grants for rural"
+
+
+def test_split_text_bounds_chunks():
+    encoding = WordEncoding()
+    text = "Short sentence one. " * 20 + "word " * 50 + BOILERPLATE
+
+    chunks = list(split_text(text, max_tokens=16, encoding=encoding))
+
+    assert all(len(encoding.encode(chunk)) <= 16 for chunk in chunks)
+    assert any(chunk.startswith("Applicant Eligibility") for chunk in chunks)
+    assert normalize_chunk(" ".join(chunks)) == normalize_chunk(text)
+
+
+def test_simhash_distance():
+    text = normalize_chunk(BOILERPLATE)
+    edited = text.replace("state and local", "state or local")
+
+    assert simhash(text) == simhash(text)
+    assert bin(simhash(text) ^ simhash(edited)).count("1") <= NEAR_DUPLICATE_DISTANCE
+    assert bin(simhash(text) ^ simhash("unrelated " * 30)).count("1") > 10
+
+
+def test_deduplicator_finds_exact_and_near():
+    deduplicator = ChunkDeduplicator()
+    normalized = normalize_chunk(BOILERPLATE)
+    kept, kind, key, value = deduplicator.find(normalized)
+    assert kept is None
+    deduplicator.keep("doc", key, value)
+
+    assert deduplicator.find(normalized)[:2] == ("doc", "exact")
+    near = normalized.replace("state and local", "state or local")
+    assert deduplicator.find(near)[:2] == ("doc", "near")
+    assert deduplicator.find(normalize_chunk("Research on wetlands."))[0] is None
+    assert ChunkDeduplicator(near=False).find(near)[0] is None
+
+
+def test_shared_chunk_spans_opportunities():
+    rows = [
+        ("1", f"Broadband for tribal communities. {BOILERPLATE}"),
+        ("2", f"Wastewater upgrades for small towns. {BOILERPLATE}"),
+        ("3", "Coastal wetland restoration. " + BOILERPLATE.replace("and", "or", 1)),
+    ]
+
+    docs = chunk_documents(rows, max_tokens=256)
+
+    shared = [doc for doc in docs if "Eligible applicants" in doc.page_content]
+    assert len(shared) == 1
+    assert shared[0].metadata["source"] == "1"
+    assert chunk_opportunities(shared[0]) == ["1", "2", "3"]
+    assert sorted(doc.metadata["source"] for doc in docs) == ["1", "1", "2", "3"]
+
+
+def test_no_dedup_keeps_every_chunk():
+    rows = [("1", BOILERPLATE), ("2", BOILERPLATE)]
+
+    docs = chunk_documents(rows, dedup=False)
+
+    assert [chunk_opportunities(doc) for doc in docs] == [["1"], ["2"]]
@@ -0,0 +1,130 @@
+import os
+import random
+
+import pytest
+from langchain.schema import Document
+from test_hybrid import GRANTS, WordEmbeddings
+
+import matcher
+from matcher import hybrid_match, match_profiles
+from utils.bm25_index import BM25Index
+from utils.compact_index import INDEX_TYPES, MmapDocstore, compact_index_type
+from utils.vector_index import (
+    COMPACT_DIR,
+    current_version,
+    load_index,
+    update_index,
+)
+
+DOCS = [
+    Document(page_content=text, metadata={"source": opp, "opportunities": [opp]})
+    for opp, text in GRANTS.items()
+]
+
+
+def test_build_exports_compact_index(tmp_path):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type="int8")
+    compact = os.path.join(tmp_path, current_version(tmp_path), COMPACT_DIR)
+
+    db, manifest = load_index(str(tmp_path), WordEmbeddings())
+    full, _ = load_index(str(tmp_path), WordEmbeddings(), compact=False)
+
+    assert compact_index_type(compact) == "int8"
+    assert isinstance(db.docstore, MmapDocstore)
+    assert not isinstance(full.docstore, MmapDocstore)
+    assert manifest["build"] == 1
+    compact_matches = match_profiles(db, WordEmbeddings(), ["rural clinics"], k=3)
+    full_matches = match_profiles(full, WordEmbeddings(), ["rural clinics"], k=3)
+    assert [opp for opp, _ in compact_matches[0]] == [
+        opp for opp, _ in full_matches[0]
+    ]
+    db.docstore.close()
+
+
+def test_unchanged_docs_export_new_index_type(tmp_path):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path))
+    assert compact_index_type(os.path.join(tmp_path, "v000001", COMPACT_DIR)) is None
+
+    update_index(DOCS, WordEmbeddings(), str(tmp_path))
+    assert current_version(tmp_path) == "v000001"
+
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type="ivf")
+    assert current_version(tmp_path) == "v000002"
+    compact = os.path.join(tmp_path, "v000002", COMPACT_DIR)
+    assert compact_index_type(compact) == "ivf"
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_filtered_search_on_compact_index(tmp_path, index_type):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type=index_type)
+    db, _ = load_index(str(tmp_path), WordEmbeddings())
+    lexical = BM25Index.build(GRANTS.items())
+
+    with db.docstore:
+        filtered = match_profiles(
+            db, WordEmbeddings(), ["rural clinics"], k=5, allowed_ids={"1", "4"}
+        )[0]
+        hybrid = hybrid_match(db, WordEmbeddings(), lexical, ["rural clinics"], k=3)
+
+    assert {opp for opp, _ in filtered} == {"1", "4"}
+    assert len(hybrid[0]) == 3
+
+
+@pytest.mark.parametrize(
+    "index_type, exact_max",
+    [(index_type, matcher.EXACT_SEARCH_MAX) for index_type in INDEX_TYPES]
+    + [("hnsw", 0)],
+)
+def test_restrictive_filter_finds_every_allowed_grant(
+    tmp_path, monkeypatch, index_type, exact_max
+):
+    monkeypatch.setattr(matcher, "EXACT_SEARCH_MAX", exact_max)
+    words = [f"w{i}" for i in range(200)]
+    rng = random.Random(0)
+    docs = [
+        Document(
+            page_content=" ".join(rng.sample(words, 8)),
+            metadata={"source": str(i), "opportunities": [str(i)]},
+        )
+        for i in range(500)
+    ]
+    update_index(docs, WordEmbeddings(), str(tmp_path), index_type=index_type)
+    db, _ = load_index(str(tmp_path), WordEmbeddings())
+    allowed = {"3", "97", "211", "350", "499"}
+
+    with db.docstore:
+        matches = match_profiles(
+            db, WordEmbeddings(), ["w1 w2 w3"], k=5, allowed_ids=allowed
+        )[0]
+
+    assert {opp for opp, _ in matches} == allowed
+
+
+def test_docstore_close(tmp_path):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type="flat")
+    compact = os.path.join(tmp_path, current_version(tmp_path), COMPACT_DIR)
+
+    with MmapDocstore(compact) as docstore:
+        assert docstore.search("1:0").page_content == GRANTS["1"]
+
+    with pytest.raises(ValueError):
+        docstore.search("1:0")
+
+
+def test_model_change_rebuilds_index(tmp_path):
+    class OtherEmbeddings(WordEmbeddings):
+        def _embed(self, text):
+            return list(reversed(super()._embed(text)))
+
+    update_index(DOCS, WordEmbeddings(), str(tmp_path))
+    update_index(DOCS, WordEmbeddings(), str(tmp_path))
+    assert current_version(tmp_path) == "v000001"
+
+    db = update_index(DOCS, OtherEmbeddings(), str(tmp_path))
+    _, manifest = load_index(str(tmp_path), OtherEmbeddings())
+
+    assert current_version(tmp_path) == "v000002"
+    assert manifest["model"] == "OtherEmbeddings"
+    assert db.index.ntotal == len(DOCS)
+    vector = db.index.reconstruct(0)
+    assert vector.tolist() == OtherEmbeddings().embed_query(DOCS[0].page_content)
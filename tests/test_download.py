@@ -0,0 +1,55 @@
+import pytest
+import requests
+from tenacity import stop_after_attempt, wait_none
+
+from download_news_grants import _post
+from utils.metrics import metrics
+
+
+class DownSession:
+    def post(self, url, **kwargs):
+        raise requests.ConnectTimeout("connect timed out")
+
+
+class StatusSession:
+    def __init__(self, status, body=b"{}"):
+        self.status, self.body, self.calls = status, body, 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code, response._content = self.status, self.body
+        return response
+
+
+def test_connection_errors_are_counted():
+    metrics.reset()
+
+    with pytest.raises(requests.ConnectTimeout):
+        post = _post.retry_with(
+            stop=stop_after_attempt(2), wait=wait_none(), reraise=True
+        )
+        post(DownSession(), "https://example.invalid/v1/api/search2")
+
+    assert metrics.counters["http.requests"] == 2
+    assert metrics.counters["http.errors"] == 2
+
+
+@pytest.mark.parametrize(
+    "status, body, error, calls",
+    [
+        (503, b"{}", requests.HTTPError, 2),
+        (429, b"{}", requests.HTTPError, 2),
+        (400, b"{}", requests.HTTPError, 1),
+        (404, b"{}", requests.HTTPError, 1),
+        (200, b"<html>", ValueError, 1),
+    ],
+)
+def test_only_transient_failures_are_retried(status, body, error, calls):
+    session = StatusSession(status, body)
+    post = _post.retry_with(stop=stop_after_attempt(2), wait=wait_none(), reraise=True)
+
+    with pytest.raises(error):
+        post(session, "https://example.invalid/v1/api/search2")
+
+    assert session.calls == calls
@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+
+import openai
+
+from utils.embedding_service import EmbeddingService, openai_backend
+
+
+class LoopBoundClient:
+    """Fake AsyncOpenAI that, like httpx, only works on the loop it started on."""
+
+    instances = []
+
+    def __init__(self):
+        self.loop = None
+        self.closed = False
+        self.embeddings = SimpleNamespace(create=self.create)
+        self.instances.append(self)
+
+    async def create(self, input, model):
+        loop = asyncio.get_running_loop()
+        self.loop = self.loop or loop
+        if self.closed or loop is not self.loop:
+            raise RuntimeError("Event loop is closed")
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=[float(len(text))]) for text in input]
+        )
+
+    async def close(self):
+        self.closed = True
+
+
+def test_each_embed_call_gets_its_own_client(monkeypatch):
+    monkeypatch.setattr(openai, "AsyncOpenAI", LoopBoundClient)
+    LoopBoundClient.instances.clear()
+    service = EmbeddingService(openai_backend("text-embedding-ada-002"), "ada")
+
+    assert service.embed(["a", "abc"]) == [[1.0], [3.0]]
+    assert service.embed(["ab"]) == [[2.0]]
+    assert len(LoopBoundClient.instances) == 2
+    assert all(client.closed for client in LoopBoundClient.instances)
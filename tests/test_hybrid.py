@@ -0,0 +1,210 @@
+import hashlib
+import shutil
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores import FAISS
+
+import matcher
+from matcher import RRF_K, batch_match, hybrid_match, match_profiles
+from utils.bm25_index import BM25Index, tokenize
+from utils.result_cache import ResultCache
+from utils.vector_index import update_index
+
+GRANTS = {
+    "1": "Rural broadband infrastructure for tribal communities",
+    "2": "Wastewater treatment upgrades for small towns",
+    "3": "Community health clinics serving rural counties",
+    "4": "Early childhood literacy programs in public libraries",
+    "5": "Research on coastal wetland restoration HHS-NIH11",
+}
+
+
+class WordEmbeddings(Embeddings):
+    """Deterministic hashed bag-of-words vectors."""
+
+    def _embed(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in tokenize(text):
+            vector[hashlib.md5(word.encode()).digest()[0] % 64] += 1
+        return (vector / max(np.linalg.norm(vector), 1)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture
+def db():
+    docs = [
+        Document(page_content=text, metadata={"source": opp, "opportunities": [opp]})
+        for opp, text in GRANTS.items()
+    ]
+    return FAISS.from_documents(docs, WordEmbeddings())
+
+
+@pytest.fixture
+def lexical():
+    return BM25Index.build(GRANTS.items())
+
+
+def test_tokenize_keeps_codes_and_parts():
+    terms = list(tokenize("The HHS-NIH11 grant, CFDA 10.001"))
+
+    assert terms == [
+        "hhs-nih11",
+        "hhs",
+        "nih11",
+        "grant",
+        "cfda",
+        "10.001",
+        "10",
+        "001",
+    ]
+
+
+def test_bm25_scores(lexical):
+    scores = lexical.scores("rural clinics")
+
+    assert scores[lexical.rows["3"]] > scores[lexical.rows["1"]] > 0
+    assert scores[lexical.rows["2"]] == 0
+    assert [opp for opp, _ in lexical.search("rural clinics")] == ["3", "1"]
+    assert [opp for opp, _ in lexical.search("rural", allowed_ids={"3"})] == ["3"]
+    assert lexical.search("nih11")[0][0] == "5"
+    assert lexical.search("unrelated words") == []
+
+
+def test_bm25_save_and_load(tmp_path, lexical):
+    lexical.save(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+
+    assert loaded.ids == lexical.ids
+    np.testing.assert_allclose(loaded.scores("rural"), lexical.scores("rural"))
+
+
+def test_bm25_save_switches_builds_atomically(tmp_path, lexical):
+    builds = [
+        BM25Index.build(dict(GRANTS, **{"6": f"Rural transit {i}"}).items())
+        for i in range(3)
+    ]
+    lexical.save(tmp_path)
+    first = BM25Index.load(tmp_path)
+    for build in builds:
+        build.save(tmp_path)
+
+    assert (tmp_path / "CURRENT").read_text() == builds[-1].version
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == sorted(
+        build.version for build in builds[-2:]
+    )
+    assert BM25Index.load(tmp_path).version == builds[-1].version
+    # a reader that loaded an older build keeps its memory-mapped postings
+    np.testing.assert_allclose(first.scores("rural"), lexical.scores("rural"))
+
+
+def test_hybrid_fills_short_shortlist(db, lexical):
+    """One lexical hit must not cap the result at one grant."""
+    query = "wastewater systems"
+
+    matches = hybrid_match(db, WordEmbeddings(), lexical, [query], k=3)[0]
+
+    assert len(matches) == 3
+    assert matches[0][0] == "2"
+    assert len({opp for opp, _ in matches}) == 3
+
+
+def test_hybrid_without_lexical_hits_matches_dense(db, lexical):
+    query = "zzz qqq"
+    dense = match_profiles(db, WordEmbeddings(), [query], k=3)[0]
+
+    assert lexical.search(query) == []
+    assert hybrid_match(db, WordEmbeddings(), lexical, [query], k=3)[0] == dense
+
+
+def test_hybrid_rrf_order(db, lexical):
+    """Fused scores follow reciprocal rank fusion of both rankings."""
+    query = "rural clinics"
+    matches = hybrid_match(db, WordEmbeddings(), lexical, [query], k=5)[0]
+    dense = [opp for opp, _ in sorted(matches, key=lambda match: match[1])]
+    lexical_ranks = [opp for opp, _ in lexical.search(query)]
+
+    def fused(opp):
+        score = 0.5 / (RRF_K + dense.index(opp) + 1)
+        if opp in lexical_ranks:
+            score += 0.5 / (RRF_K + lexical_ranks.index(opp) + 1)
+        return score
+
+    assert [opp for opp, _ in matches] == sorted(dense, key=fused, reverse=True)
+
+
+def test_hybrid_respects_allowed_ids(db, lexical):
+    matches = hybrid_match(
+        db, WordEmbeddings(), lexical, ["rural clinics"], k=5, allowed_ids={"1", "4"}
+    )[0]
+
+    assert {opp for opp, _ in matches} == {"1", "4"}
+    assert hybrid_match(
+        db, WordEmbeddings(), lexical, ["rural"], k=5, allowed_ids={"missing"}
+    ) == [[]]
+
+
+def test_bm25_version_follows_content(tmp_path, lexical):
+    lexical.save(tmp_path)
+
+    assert BM25Index.load(tmp_path).version == lexical.version
+    assert BM25Index.build(GRANTS.items()).version == lexical.version
+    changed = dict(GRANTS, **{"6": "Rural transit buses"})
+    assert BM25Index.build(changed.items()).version != lexical.version
+
+
+def test_cached_matches_follow_builds(tmp_path, monkeypatch, lexical):
+    index_dir, bm25_dir = tmp_path / "grants_db", tmp_path / "bm25"
+    docs = [
+        Document(page_content=text, metadata={"source": opp, "opportunities": [opp]})
+        for opp, text in GRANTS.items()
+    ]
+    update_index(docs, WordEmbeddings(), str(index_dir))
+    lexical.save(bm25_dir)
+    profiles = tmp_path / "profiles.csv"
+    profiles.write_text("profile_id,description\np1,rural clinics\n")
+    cache = ResultCache(None)
+    computed = []
+    for name in ("hybrid_match", "match_profiles"):
+        original = getattr(matcher, name)
+
+        def counted(*args, original=original, name=name, **kwargs):
+            computed.append(name)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(matcher, name, counted)
+
+    def run(hybrid):
+        computed.clear()
+        batch_match(
+            profiles,
+            tmp_path / "matches.csv",
+            embedding_function=WordEmbeddings(),
+            k=3,
+            index_dir=str(index_dir),
+            hybrid=hybrid,
+            bm25_dir=bm25_dir,
+            result_cache=cache,
+        )
+        return computed[:]
+
+    assert run(hybrid=True) == ["hybrid_match"]
+    assert run(hybrid=False) == ["match_profiles"]
+    # dense and hybrid results do not invalidate each other
+    assert run(hybrid=True) == run(hybrid=False) == []
+
+    BM25Index.build(dict(GRANTS, **{"6": "Rural clinics"}).items()).save(bm25_dir)
+    assert run(hybrid=True) == ["hybrid_match"]
+    assert run(hybrid=False) == []
+
+    # a build deleted and rebuilt from other grants restarts the build counter
+    shutil.rmtree(index_dir)
+    update_index(docs[:3], WordEmbeddings(), str(index_dir))
+    assert run(hybrid=False) == ["match_profiles"]
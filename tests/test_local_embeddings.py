@@ -0,0 +1,37 @@
+import atexit
+
+import numpy as np
+
+from utils.local_embeddings import LocalEmbeddings
+
+
+class FakeModel:
+    def __init__(self):
+        self.pools = []
+
+    def start_multi_process_pool(self, devices):
+        self.pools.append(devices)
+        return devices
+
+    def stop_multi_process_pool(self, pool):
+        self.pools.remove(pool)
+
+    def encode_multi_process(self, texts, pool, **kwargs):
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+def test_pool_is_stopped_on_exit(monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr(atexit, "unregister", registered.remove)
+    model = FakeModel()
+
+    with LocalEmbeddings(batch_size=1, processes=2) as embeddings:
+        embeddings._model = model
+        vectors = embeddings.encode(["a", "abc", "ab"])
+        assert model.pools == [["cpu", "cpu"]]
+        assert registered == [embeddings.close]
+
+    assert vectors[:, 0].tolist() == [1, 3, 2]
+    assert model.pools == []
+    assert registered == []
@@ -0,0 +1,42 @@
+import pytest
+from test_compact_index import DOCS
+from test_hybrid import WordEmbeddings
+
+from match_server import IndexHolder
+from utils.vector_index import update_index
+
+
+def test_replaced_build_closes_after_last_query(tmp_path):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type="flat")
+    holder = IndexHolder(WordEmbeddings(), str(tmp_path), poll_interval=3600)
+
+    with holder.acquire() as (db, version):
+        update_index(DOCS[1:], WordEmbeddings(), str(tmp_path), index_type="flat")
+        holder.reload()
+
+        assert holder.current[1] != version == "v000001"
+        assert db.docstore.search("1:0").page_content == DOCS[0].page_content
+
+    with pytest.raises(ValueError):
+        db.docstore.search("1:0")
+    new_db, _ = holder.current
+    assert new_db.docstore.search("2:0").page_content == DOCS[1].page_content
+
+    holder.reload()
+    assert holder.current[0] is new_db
+    holder.stop()
+    with pytest.raises(ValueError):
+        new_db.docstore.search("2:0")
+
+
+def test_unused_build_closes_on_swap(tmp_path):
+    update_index(DOCS, WordEmbeddings(), str(tmp_path), index_type="flat")
+    holder = IndexHolder(WordEmbeddings(), str(tmp_path), poll_interval=3600)
+    db, _ = holder.current
+
+    update_index(DOCS[1:], WordEmbeddings(), str(tmp_path), index_type="flat")
+    holder.reload()
+
+    with pytest.raises(ValueError):
+        db.docstore.search("1:0")
+    holder.stop()
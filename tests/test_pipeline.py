@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def failing(run_date):
+    raise ConnectionError("network is down")
+
+
+def test_optional_stage_failure_does_not_stop_the_run(tmp_path):
+    ran = []
+    stages = [
+        Stage("fetch", failing, always_run=True, optional=True),
+        Stage("build", ran.append, after=["fetch"]),
+    ]
+
+    Pipeline(stages, state_path=str(tmp_path / "state.json")).run("2024-01-01")
+
+    assert ran == ["2024-01-01"]
+
+
+def test_required_stage_failure_stops_the_run(tmp_path):
+    ran = []
+    stages = [
+        Stage("fetch", failing, always_run=True),
+        Stage("build", ran.append, after=["fetch"]),
+    ]
+
+    with pytest.raises(ConnectionError):
+        Pipeline(stages, state_path=str(tmp_path / "state.json")).run("2024-01-01")
+    assert ran == []
+
+
+def test_metrics_are_emitted_when_a_stage_fails(tmp_path, monkeypatch):
+    metrics_path = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("GRANTS_METRICS_PATH", str(metrics_path))
+    stages = [Stage("fetch", failing, always_run=True)]
+
+    with pytest.raises(ConnectionError):
+        Pipeline(stages, state_path=str(tmp_path / "state.json")).run("2024-01-01")
+
+    record = json.loads(metrics_path.read_text())
+    assert record["status"] == "failed"
+    assert record["timers"]["stage.fetch"]["count"] == 1
+
+
+def test_changed_params_rerun_the_stage(tmp_path):
+    source = tmp_path / "input.txt"
+    source.write_text("grants")
+    state_path = str(tmp_path / "state.json")
+    ran = []
+
+    def run(index_type):
+        stage = Stage(
+            "embed",
+            lambda run_date: ran.append(index_type),
+            inputs=[str(source)],
+            params={"index_type": index_type},
+        )
+        Pipeline([stage], state_path=state_path).run("2024-01-01")
+
+    run(None)
+    run(None)
+    run("int8")
+    run("int8")
+
+    assert ran == [None, "int8"]
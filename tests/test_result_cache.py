@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from utils.result_cache import ResultCache, params_key
+
+VECTOR = np.arange(4, dtype=np.float32)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    path = None if request.param == "memory" else str(tmp_path / "cache.sqlite")
+    cache = ResultCache(path, max_entries=3, memory_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_lookup_after_store(cache):
+    assert cache.lookup("profile", "model", "v1") == (None, None)
+
+    cache.store("profile", "model", "v1", "", VECTOR, [("1", 0.5), (2, 1)])
+    vector, matches = cache.lookup("profile", "model", "v1")
+
+    np.testing.assert_array_equal(vector, VECTOR)
+    assert matches == [("1", 0.5), ("2", 1.0)]
+    assert cache.lookup("profile", "other model", "v1") == (None, None)
+
+
+def test_params_are_part_of_the_key(cache):
+    cache.store("profile", "model", "v1", params_key(k=5), VECTOR, [("1", 0.5)])
+
+    vector, matches = cache.lookup("profile", "model", "v1", params_key(k=10))
+
+    assert vector is not None and matches is None
+    assert params_key(ids={"b", "a"}) == params_key(ids={"a", "b"})
+
+
+def test_new_index_version_supersedes_results_but_keeps_vectors(cache):
+    cache.store("profile", "model", "v1", "", VECTOR, [("1", 0.5)])
+    cache.store("profile", "model", "v1", params_key(k=5), VECTOR, [("1", 0.5)])
+    cache.store("other", "model", "v1", "", VECTOR, [("2", 0.5)])
+
+    vector, matches = cache.lookup("profile", "model", "v2")
+    np.testing.assert_array_equal(vector, VECTOR)
+    assert matches is None
+    cache.store("profile", "model", "v2", "", VECTOR, [("3", 0.5)])
+
+    assert cache.lookup("profile", "model", "v1")[1] is None
+    assert cache.lookup("profile", "model", "v2")[1] == [("3", 0.5)]
+    assert cache.lookup("profile", "model", "v1", params_key(k=5))[1] is not None
+    assert cache.lookup("other", "model", "v1")[1] == [("2", 0.5)]
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(None, memory_entries=2)
+    for text in ("a", "b"):
+        cache.store(text, "model", "v1", "", VECTOR, [])
+    cache.lookup("a", "model", "v1")
+    cache.store("c", "model", "v1", "", VECTOR, [])
+
+    assert len(cache) == 2
+    assert cache.lookup("b", "model", "v1") == (None, None)
+    assert cache.lookup("a", "model", "v1")[1] == []
+
+
+def test_sqlite_evicts_least_recently_used(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResultCache(path, max_entries=2, memory_entries=1)
+    for text in ("a", "b", "c"):
+        cache.store(text, "model", "v1", "", VECTOR, [(text, 0.0)])
+        cache.lookup("a", "model", "v1")
+    cache.close()
+
+    reopened = ResultCache(path)
+    assert len(reopened) == 2
+    assert reopened.lookup("a", "model", "v1")[1] == [("a", 0.0)]
+    assert reopened.lookup("b", "model", "v1") == (None, None)
+    reopened.close()
@@ -0,0 +1,93 @@
+import csv
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from utils.snapshots import (
+    compact_snapshots,
+    diff_snapshots,
+    read_snapshot,
+    snapshot_dates,
+    snapshot_path,
+)
+
+COLUMNS = ["opportunity_id", "title", "close_date"]
+
+
+def write_snapshot(data_dir, day, rows):
+    with open(os.path.join(data_dir, f"{day}.csv"), "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def day_rows(i):
+    """A few stable grants, one that changes daily and one added every 7 days."""
+    rows = [
+        {"opportunity_id": "1", "title": "Stable grant", "close_date": "2030-01-01"},
+        {"opportunity_id": "2", "title": f"Revision {i}", "close_date": "2030-01-01"},
+    ]
+    rows.append({"opportunity_id": f"w{i // 7}", "title": "Weekly", "close_date": ""})
+    return rows
+
+
+def make_days(data_dir, n):
+    start = date(2023, 1, 1)
+    days = [(start + timedelta(i)).isoformat() for i in range(n)]
+    for i, day in enumerate(days):
+        write_snapshot(data_dir, day, day_rows(i))
+    return days
+
+
+def test_diff_snapshots(tmp_path):
+    days = make_days(tmp_path, 8)
+
+    diff = diff_snapshots(days[6], days[7], tmp_path)
+
+    assert diff.added == ["w1"]
+    assert diff.removed == ["w0"]
+    assert diff.modified == ["2"]
+    assert diff.changed == ["w1", "2"]
+
+
+def test_compaction_rebuilds_every_day(tmp_path):
+    days = make_days(tmp_path, 10)
+
+    compacted = compact_snapshots(tmp_path, keep=2, checkpoint=None)
+
+    assert compacted == days[:-2]
+    assert snapshot_dates(tmp_path) == days
+    for i, day in enumerate(days):
+        columns, rows = read_snapshot(day, tmp_path)
+        assert columns == COLUMNS
+        assert list(rows.values()) == day_rows(i)
+
+
+def test_compaction_keeps_checkpoints(tmp_path):
+    days = make_days(tmp_path, 25)
+
+    compacted = compact_snapshots(tmp_path, checkpoint=10)
+
+    full = [day for day in days if snapshot_path(day, tmp_path)]
+    assert full == [days[9], days[19], days[24]]
+    assert set(compacted) == set(days) - set(full)
+    assert list(read_snapshot(days[0], tmp_path)[1].values()) == day_rows(0)
+
+
+def test_long_delta_chain(tmp_path):
+    """Rebuilding the oldest of ~3 years of deltas must not recurse per day."""
+    days = make_days(tmp_path, 1100)
+
+    compact_snapshots(tmp_path, checkpoint=None)
+
+    assert [day for day in days if snapshot_path(day, tmp_path)] == days[-1:]
+    assert list(read_snapshot(days[0], tmp_path)[1].values()) == day_rows(0)
+    assert diff_snapshots(days[0], days[1], tmp_path).modified == ["2"]
+
+
+def test_missing_day(tmp_path):
+    make_days(tmp_path, 2)
+
+    with pytest.raises(FileNotFoundError):
+        read_snapshot("1999-01-01", tmp_path)